@@ -0,0 +1,50 @@
+"""
+Benchmark - MessageDatabase feature methods against the per-row DataFrame.apply implementations they replaced.
+Usage: python -m benchmarks.bench_features [number_of_messages]
+"""
+import sys
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.generate_export import generate_database
+from benchmarks.suite import seconds
+from project_code.data_prep import TIME_COL, CONTENT_COL
+
+
+def count_words_apply(df):
+    return df.apply(lambda row: len(row[CONTENT_COL].split(' ')), axis=1)
+
+
+def count_special_punctuation_apply(df):
+    return df.apply(lambda row: sum([row[CONTENT_COL].count(mark) for mark in '?!']), axis=1)
+
+
+def time_bin_apply(df):
+    return df.apply(lambda row: '{}:00'.format(row[TIME_COL].hour), axis=1)
+
+
+def time_diff_apply(df):
+    diff = df[TIME_COL] - df[TIME_COL].shift(1)
+    return diff.apply(lambda delta: delta.total_seconds() / 60 if not pd.isnull(delta) else np.nan)
+
+
+def main(number_of_messages=1000000):
+    db = generate_database(number_of_messages)
+    comparisons = [
+        ('word_count', count_words_apply, db._count_words),
+        ('punctuation_count', count_special_punctuation_apply, db._count_special_punctuation),
+        ('time_bin', time_bin_apply, db._time_bin),
+        ('time_diff', time_diff_apply, db._time_diff),
+    ]
+    print('{:,} messages, {:,} rows'.format(number_of_messages, len(db.df)))
+    print('{:<20} {:>10} {:>15} {:>9}'.format('feature', 'apply (s)', 'vectorized (s)', 'speedup'))
+    for feature, apply_function, vectorized_function in comparisons:
+        apply_seconds = seconds(apply_function, db.df)
+        vectorized_seconds = seconds(vectorized_function)
+        print('{:<20} {:>10.2f} {:>15.3f} {:>8.0f}x'.format(
+            feature, apply_seconds, vectorized_seconds, apply_seconds / vectorized_seconds))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,31 @@
+"""
+Benchmark - memory used by MessageDatabase.df with senders as strings against senders as a categorical, and time of
+map_senders on the categorical.
+Usage: python -m benchmarks.bench_memory [number_of_messages]
+"""
+import sys
+import time
+
+from benchmarks.generate_export import generate_database
+from project_code.data_prep import SENDER_COL
+
+
+def main(number_of_messages=1000000):
+    db = generate_database(number_of_messages)
+    db.df[SENDER_COL] = db.df[SENDER_COL].astype(object)
+    object_bytes = db.memory_usage()
+    db._set_messages(db.df)
+    categorical_bytes = db.memory_usage()
+
+    start = time.perf_counter()
+    db.map_senders({u'bob': u'robert'})
+    map_seconds = time.perf_counter() - start
+
+    print('{:,} messages, {:,} rows'.format(number_of_messages, len(db.df)))
+    print('senders as strings      {:>12,.1f} MB'.format(object_bytes / 1e6))
+    print('senders as categorical  {:>12,.1f} MB'.format(categorical_bytes / 1e6))
+    print('map_senders             {:>12.4f} s'.format(map_seconds))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,40 @@
+"""
+Benchmark - lines per second of read_file (bulk parser) against read_file_per_line (parse_message per line), and of
+read_file parsing in parallel with several worker processes.
+Usage: python -m benchmarks.bench_read_file [number_of_messages] [workers]
+"""
+import os
+import sys
+import tempfile
+
+from functools import partial
+
+from benchmarks.generate_export import expected_rows, generate_messages, write_export
+from benchmarks.suite import seconds
+from project_code.data_prep import read_file, read_file_per_line
+
+
+def lines_per_second(reader, path_to_file, number_of_lines, repeat=3):
+    return number_of_lines / min(seconds(reader, path_to_file) for _ in range(repeat))
+
+
+def main(number_of_messages=200000, workers=os.cpu_count()):
+    handle, path_to_file = tempfile.mkstemp(suffix='.txt')
+    os.close(handle)
+    try:
+        messages = generate_messages(number_of_messages)
+        write_export(path_to_file, messages)
+        number_of_lines = len(expected_rows(messages))
+        readers = [
+            ('read_file_per_line', read_file_per_line),
+            ('read_file', read_file),
+            ('read_file ({} workers)'.format(workers), partial(read_file, workers=workers)),
+        ]
+        for name, reader in readers:
+            print('{:<24} {:>12,.0f} lines/sec'.format(name, lines_per_second(reader, path_to_file, number_of_lines)))
+    finally:
+        os.remove(path_to_file)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,45 @@
+"""
+Benchmark - SentimentScorer on synthetic messages against scoring each message with a per-row Python function.
+Runs on random messages (mostly distinct) and on chat-like messages, drawn from a small pool with a Zipf
+distribution, as chats repeat the same short messages a lot.
+Usage: python -m benchmarks.bench_sentiment [number_of_messages]
+"""
+import sys
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.generate_export import generate_messages
+from benchmarks.suite import seconds
+from project_code.data_prep import CONTENT_COL
+from project_code.sentiment import SentimentScorer
+from project_code.text_index import tokenize
+
+LEXICON = {u'hello': 0.5, u'great': 1, u'nothing': -0.5, u'תודה': 1, u'שלום': 0.5}
+
+
+def score_per_row(contents):
+    return contents.apply(lambda content: sum(LEXICON.get(token, 0) for token in tokenize(content)))
+
+
+def chat_like_contents(number_of_messages, pool_size=20000, seed=0):
+    random_state = np.random.RandomState(seed)
+    pool = generate_messages(pool_size, seed=seed)[CONTENT_COL].values
+    return pd.Series(pool[(random_state.zipf(1.3, number_of_messages) - 1) % pool_size])
+
+
+def run(name, contents):
+    scorer = SentimentScorer(LEXICON)
+    print('{} - {:,} messages, {:,} distinct'.format(name, len(contents), contents.nunique()))
+    print('  {:<28} {:>10.2f} s'.format('per-row function', seconds(score_per_row, contents)))
+    print('  {:<28} {:>10.2f} s'.format('SentimentScorer (cold cache)', seconds(scorer.score, contents)))
+    print('  {:<28} {:>10.2f} s'.format('SentimentScorer (warm cache)', seconds(scorer.score, contents)))
+
+
+def main(number_of_messages=1000000):
+    run('random', generate_messages(number_of_messages)[CONTENT_COL])
+    run('chat-like', chat_like_contents(number_of_messages))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,133 @@
+"""
+Synthetic WhatsApp exports - messages with realistic senders (Unicode names, phone numbers wrapped in direction
+marks), mixed Hebrew and English contents and multi-line messages, in either date format parse_message handles.
+Usage: python -m benchmarks.generate_export path_to_file [number_of_messages] [date_format]
+"""
+import sys
+
+import numpy as np
+import pandas as pd
+
+from project_code.data_prep import (
+    TIME_COL, SENDER_COL, CONTENT_COL, DATE_FORMAT_SLASH, DATE_FORMAT_DOT, MessageDatabase,
+)
+
+DATE_FORMATS = {'slash': DATE_FORMAT_SLASH, 'dot': DATE_FORMAT_DOT}
+
+SENDERS = [
+    u'bob',
+    u'alice is the best',
+    u'charles, you know who he is',
+    u'‪+972 50-686-1962‬',
+    u'‪+1 (434) 227-2185‬',
+    u'אדי',
+    u'נועה 🌸',
+]
+# no word contains ': ', which would make a continuation line look like a message header
+WORDS = [
+    u'hello', u'hi', u'ok', u'what?', u'great!', u'tomorrow', u'at', u'the', u'meeting', u'lol', u'😂', u'👍',
+    u'שלום', u'תודה!', u'מה', u'קורה?', u'על', u'את', u'הבית', u'מחר', u'בסדר', u'יאללה', u'צה"ל', u'חחחח',
+]
+START_TIME = pd.Timestamp('2016-05-19 20:41')
+MAX_GAP_MINUTES = 30  # gaps between consecutive messages are uniform in [0, MAX_GAP_MINUTES)
+
+
+def generate_messages(number_of_messages, start=START_TIME, multiline_ratio=0.1, seed=0):
+    """
+    Generates time-sorted messages. A multi-line message has its lines separated by '\n' in its content.
+    :param number_of_messages: int
+    :param start: Timestamp, time of the first message
+    :param multiline_ratio: float, fraction of messages with more than one line
+    :param seed: int, seed of the random generator - the same arguments always give the same messages
+    :return: DataFrame with columns of TIME_COL, SENDER_COL, CONTENT_COL
+    """
+    random_state = np.random.RandomState(seed)
+    minutes = np.cumsum(random_state.randint(0, MAX_GAP_MINUTES, number_of_messages))
+    senders = np.array(SENDERS, dtype=object)[random_state.randint(0, len(SENDERS), number_of_messages)]
+
+    lines_per_message = np.where(random_state.random_sample(number_of_messages) < multiline_ratio,
+                                 random_state.randint(2, 5, number_of_messages), 1)
+    words_per_line = random_state.randint(1, 12, lines_per_message.sum())
+    words = np.array(WORDS, dtype=object)[random_state.randint(0, len(WORDS), words_per_line.sum())]
+    lines = [u' '.join(line) for line in np.split(words, np.cumsum(words_per_line)[:-1])]
+    contents = [u'\n'.join(message) for message in np.split(np.array(lines, dtype=object),
+                                                             np.cumsum(lines_per_message)[:-1])]
+
+    return pd.DataFrame(data={
+        TIME_COL: start.floor('min') + pd.to_timedelta(minutes, unit='m'),
+        SENDER_COL: senders,
+        CONTENT_COL: contents,
+    })
+
+
+def overlapping_messages(number_of_messages, overlap, **kwargs):
+    """
+    Generates the messages of two exports of the same chat - the last overlap messages of the first are the first
+    overlap messages of the second, as when a chat is exported again after it went on.
+    :param number_of_messages: int, messages in each export
+    :param overlap: int, messages in both exports
+    :param kwargs: passed to generate_messages
+    :return: tuple of two DataFrames, as returned by generate_messages
+    """
+    if not 0 <= overlap <= number_of_messages:
+        raise Exception('Overlap must be between 0 and the number of messages - {}'.format(overlap))
+    messages = generate_messages(2 * number_of_messages - overlap, **kwargs)
+    return (messages.iloc[:number_of_messages].reset_index(drop=True),
+            messages.iloc[number_of_messages - overlap:].reset_index(drop=True))
+
+
+def format_export(messages, date_format='slash'):
+    """
+    :param messages: DataFrame, as returned by generate_messages
+    :param date_format: string, key of DATE_FORMATS
+    :return: string, the messages as the text of an export
+    """
+    if date_format not in DATE_FORMATS:
+        raise Exception('Unknown date format - {}'.format(date_format))
+    times = messages[TIME_COL].dt.strftime(DATE_FORMATS[date_format])
+    if date_format == 'slash':
+        # WhatsApp writes month and day of the mm/dd/yy format without leading zeros
+        times = times.str.replace(r'^0?(\d+)/0?(\d+)/', r'\1/\2/', regex=True)
+    headers = times + u' - ' + messages[SENDER_COL] + u': '
+    return u''.join(headers + messages[CONTENT_COL] + u'\n')
+
+
+def write_export(path_to_file, messages, date_format='slash'):
+    """
+    Writes messages as an export, in utf-8.
+    :param path_to_file: string
+    :param messages: DataFrame, as returned by generate_messages
+    :param date_format: string, key of DATE_FORMATS
+    """
+    with open(path_to_file, 'wb') as f:
+        f.write(format_export(messages, date_format).encode('utf-8'))
+
+
+def expected_rows(messages):
+    """
+    :param messages: DataFrame, as returned by generate_messages
+    :return: DataFrame, the rows read_file returns for an export of messages - one per line
+    """
+    rows = messages.assign(**{CONTENT_COL: messages[CONTENT_COL].str.split('\n')}).explode(CONTENT_COL)
+    return rows.reset_index(drop=True)
+
+
+def generate_database(number_of_messages, **kwargs):
+    """
+    Builds a MessageDatabase of generated messages without writing and parsing an export - with the rows read_file
+    would return for it (see expected_rows), stored as the database stores messages read from a file.
+    :param number_of_messages: int
+    :param kwargs: passed to generate_messages
+    :return: MessageDatabase
+    """
+    db = MessageDatabase()
+    db._set_messages(expected_rows(generate_messages(number_of_messages, **kwargs)))
+    return db
+
+
+def main(path_to_file, number_of_messages=100000, date_format='slash'):
+    write_export(path_to_file, generate_messages(int(number_of_messages)), date_format)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,284 @@
+"""
+Benchmark suite - parse throughput, merge cost against overlap size and feature computation, on synthetic exports.
+Each run is recorded as a json file, and can be compared with an earlier one to spot regressions.
+Usage: python -m benchmarks.suite [--messages N] [--repeat N] [--output path] [--compare path] [--filter text]
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.generate_export import (
+    DATE_FORMATS, expected_rows, generate_messages, overlapping_messages, write_export,
+)
+from project_code.data_prep import MessageDatabase, load_stopwords, read_file, read_file_chunked
+from project_code.sharded import ShardedMessageDatabase
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+OVERLAP_FRACTIONS = [0, 0.1, 0.5, 0.9]
+SHARDED_CHATS = 8  # chats the messages of the sharded benchmarks are split into
+SYNTHETIC_STOPWORDS = [u'על', u'את', u'at', u'the']
+REGRESSION_THRESHOLD = 1.2  # a benchmark slower than this ratio of the compared run is reported as a regression
+
+
+def seconds(function, *args):
+    """
+    :param function: callable
+    :param args: passed to function
+    :return: float, seconds function took to run
+    """
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def matches(name, name_filter):
+    """
+    :param name: string, name of a benchmark
+    :param name_filter: string or None, see run
+    :return: bool, whether the benchmark is run
+    """
+    return name_filter is None or name_filter in name
+
+
+class Benchmark(object):
+    """
+    A timed operation. setup runs before each repeat and is not timed - its result is passed to run.
+    """
+
+    def __init__(self, name, run, rows, setup=None):
+        """
+        :param name: string
+        :param run: callable, gets the result of setup (or nothing, without setup)
+        :param rows: int, rows processed by run - for throughput
+        :param setup: callable or None
+        """
+        self.name = name
+        self.run = run
+        self.rows = rows
+        self.setup = setup
+
+    def measure(self, repeat):
+        """
+        :param repeat: int, number of timed runs
+        :return: list of floats, seconds of each run
+        """
+        timings = []
+        for _ in range(repeat):
+            args = () if self.setup is None else (self.setup(),)
+            timings.append(seconds(self.run, *args))
+        return timings
+
+
+def parse_benchmarks(directory, number_of_messages, name_filter=None):
+    """
+    :return: list of Benchmark - read_file and read_file_chunked on an export in each date format, those that match
+        name_filter
+    """
+    messages = rows = None
+    benchmarks = []
+    for date_format in sorted(DATE_FORMATS):
+        path_to_file = os.path.join(directory, 'export_{}.txt'.format(date_format))
+        runs = [
+            ('parse/read_file/{}'.format(date_format), lambda pth=path_to_file: read_file(pth)),
+            ('parse/read_file_chunked/{}'.format(date_format), lambda pth=path_to_file: list(read_file_chunked(pth))),
+        ]
+        runs = [(name, run) for name, run in runs if matches(name, name_filter)]
+        if not runs:
+            continue
+        if messages is None:
+            messages = generate_messages(number_of_messages)
+            rows = len(expected_rows(messages))
+        write_export(path_to_file, messages, date_format)
+        benchmarks.extend(Benchmark(name, run, rows) for name, run in runs)
+    return benchmarks
+
+
+def merge_benchmarks(directory, number_of_messages, name_filter=None):
+    """
+    :return: list of Benchmark - add_from_file of an export overlapping the database by a fraction of its messages,
+        those that match name_filter
+    """
+    benchmarks = []
+    for fraction in OVERLAP_FRACTIONS:
+        name = 'merge/add_from_file/overlap={:.0%}'.format(fraction)
+        if not matches(name, name_filter):
+            continue
+        first, second = overlapping_messages(number_of_messages, int(number_of_messages * fraction), seed=1)
+        first_path = os.path.join(directory, 'first_{}.txt'.format(fraction))
+        second_path = os.path.join(directory, 'second_{}.txt'.format(fraction))
+        write_export(first_path, first)
+        write_export(second_path, second)
+        benchmarks.append(Benchmark(
+            name,
+            lambda db, pth=second_path: db.add_from_file(pth),
+            len(expected_rows(second)),
+            setup=lambda pth=first_path: MessageDatabase(pth),
+        ))
+    return benchmarks
+
+
+def feature_benchmarks(directory, number_of_messages, name_filter=None):
+    """
+    :return: list of Benchmark - each feature of MessageDatabase.FEATURES, computed on the whole database, those that
+        match name_filter
+    """
+    features = [(name, method) for name, method in sorted(MessageDatabase.FEATURES.items())
+                if matches('features/{}'.format(name), name_filter)]
+    if not features:
+        return []
+    path_to_file = os.path.join(directory, 'features.txt')
+    write_export(path_to_file, generate_messages(number_of_messages, seed=2))
+    db = MessageDatabase(path_to_file)
+    # the stopwords file is private data - stopwords of the synthetic messages are loaded instead
+    path_to_stopwords = os.path.join(directory, 'stopwords.csv')
+    pd.DataFrame(data={'Undotted': SYNTHETIC_STOPWORDS, 'POS': 'preposition'}).to_csv(
+        path_to_stopwords, index=False, encoding='utf-8')
+    load_stopwords(path_to_stopwords, encoding='utf-8')
+    return [
+        Benchmark('features/{}'.format(name), getattr(db, method), len(db.df))
+        for name, method in features
+    ]
+
+
+def sharded_benchmarks(directory, number_of_messages, name_filter=None):
+    """
+    :return: list of Benchmark - cross chat queries of a ShardedMessageDatabase of SHARDED_CHATS chats, those that
+        match name_filter
+    """
+    queries = [
+        ('sharded/top_senders', lambda db: db.top_senders()),
+        # answered from the rollups each shard keeps, after the first repeat
+        ('sharded/activity', lambda db: db.activity('day')),
+    ]
+    queries = [(name, query) for name, query in queries if matches(name, name_filter)]
+    if not queries:
+        return []
+    db = ShardedMessageDatabase()
+    for chat in range(SHARDED_CHATS):
+        path_to_file = os.path.join(directory, 'chat_{}.txt'.format(chat))
+        write_export(path_to_file, generate_messages(number_of_messages // SHARDED_CHATS, seed=3 + chat))
+        db.add_from_file(path_to_file)
+    rows = int(db.message_counts().sum())
+    return [Benchmark(name, lambda query=query: query(db), rows) for name, query in queries]
+
+
+def environment():
+    """
+    :return: dict, what the results depend on besides the code - versions and machine
+    """
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (subprocess.CalledProcessError, OSError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def run(number_of_messages, repeat, name_filter=None):
+    """
+    Runs the suite.
+    :param number_of_messages: int, messages in each synthetic export
+    :param repeat: int, timed runs of each benchmark
+    :param name_filter: string or None, only benchmarks whose name contains it are run
+    :return: dict, the results - environment, parameters and per benchmark timings
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        # only the benchmarks that match name_filter are built, so the exports of the others are not written
+        benchmarks = (parse_benchmarks(directory, number_of_messages, name_filter) +
+                      merge_benchmarks(directory, number_of_messages, name_filter) +
+                      feature_benchmarks(directory, number_of_messages, name_filter) +
+                      sharded_benchmarks(directory, number_of_messages, name_filter))
+        results = {}
+        for benchmark in benchmarks:
+            timings = benchmark.measure(repeat)
+            results[benchmark.name] = {
+                'best': min(timings),
+                'median': float(np.median(timings)),
+                'rows': benchmark.rows,
+                'rows_per_second': benchmark.rows / min(timings),
+            }
+            print('{:<40} {:>10.4f} s {:>14,.0f} rows/sec'.format(
+                benchmark.name, results[benchmark.name]['best'], results[benchmark.name]['rows_per_second']))
+    finally:
+        shutil.rmtree(directory)
+
+    return {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'environment': environment(),
+        'messages': number_of_messages,
+        'repeat': repeat,
+        'benchmarks': results,
+    }
+
+
+def compare(results, previous_results, threshold=REGRESSION_THRESHOLD):
+    """
+    Prints the ratio of the best time of each benchmark to its best time in previous_results.
+    :param results: dict, as returned by run
+    :param previous_results: dict, as returned by run
+    :param threshold: float, ratio above which a benchmark is reported as a regression
+    :return: list of strings, names of the regressed benchmarks
+    """
+    if results['messages'] != previous_results['messages']:
+        print('Note - compared runs used different sizes ({:,} and {:,} messages)'.format(
+            previous_results['messages'], results['messages']))
+
+    regressions = []
+    for name, result in sorted(results['benchmarks'].items()):
+        previous = previous_results['benchmarks'].get(name)
+        if previous is None:
+            continue
+        ratio = result['best'] / previous['best']
+        is_regression = ratio > threshold
+        if is_regression:
+            regressions.append(name)
+        print('{:<40} {:>6.2f}x{}'.format(name, ratio, '  REGRESSION' if is_regression else ''))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs the ingest benchmark suite on synthetic exports.')
+    parser.add_argument('--messages', type=int, default=200000, help='messages in each synthetic export')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs of each benchmark')
+    parser.add_argument('--output', help='json file to record the results in, defaults to a new file in {}'.format(
+        RESULTS_DIRECTORY))
+    parser.add_argument('--compare', help='json file of an earlier run to compare with')
+    parser.add_argument('--filter', help='only run benchmarks whose name contains this text')
+    args = parser.parse_args()
+
+    results = run(args.messages, args.repeat, args.filter)
+
+    output = args.output
+    if output is None:
+        if not os.path.isdir(RESULTS_DIRECTORY):
+            os.makedirs(RESULTS_DIRECTORY)
+        output = os.path.join(RESULTS_DIRECTORY, '{}-{}.json'.format(
+            datetime.now().strftime('%Y%m%d-%H%M%S'), (results['environment']['commit'] or 'unknown')[:8]))
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Results recorded in {}'.format(output))
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
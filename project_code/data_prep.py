@@ -1,62 +1,562 @@
+import codecs
+import hashlib
+import json
+import mmap
+import numpy as np
 import pandas as pd
 import re
+import threading
 
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from functools import lru_cache, partial
+from itertools import islice
 from os import path
 
+from project_code.profiling import stage
+from project_code.text_index import TextIndex
+from project_code.translation import DEFAULT_TARGET_LANGUAGE, translate_series
+
 PATH_TO_DATA = r'C:\Users\Anat\Documents\whatsapp_project_data'
 
 TIME_COL = 'message_time'
 SENDER_COL = 'message_sender'
 CONTENT_COL = 'message_content'
+TRANSLATION_COL = 'message_translation'  # added by MessageDatabase.add_translation
+SENTIMENT_COL = 'message_sentiment'  # added by MessageDatabase.add_sentiment
+
+# stopwords are read on first use, see load_stopwords
+STOPWORDS_FILE = 'stopwords.csv'
+STOPWORDS_ENCODING = 'ANSI'
+_stopwords = None
+
+# WhatsApp message header - "mm/dd/yy, HH:MM - <sender>: " or "dd.mm.yyyy, HH:MM - <sender>: "
+TIME_SENDER_PATTERN = re.compile(
+    r'(?P<time>[0-9]{1,2}[/.][0-9]{1,2}[/.][0-9]{2,4}, [0-9]{2}:[0-9]{2}) - (?P<sender>.+): '
+)
+# one line of the export - an optional header followed by content, matched over the whole buffer by the bulk parser
+LINE_PATTERN = re.compile(r'^(?:' + TIME_SENDER_PATTERN.pattern + r')?(?P<content>.*)$', re.MULTILINE)
+
+DATE_FORMAT_SLASH = '%m/%d/%y, %H:%M'
+DATE_FORMAT_DOT = '%d.%m.%Y, %H:%M'
+# date format -> separator of its date part, and number of digits of its year
+DATE_SEPARATORS = {DATE_FORMAT_SLASH: '/', DATE_FORMAT_DOT: '.'}
+YEAR_DIGITS = {DATE_FORMAT_SLASH: 2, DATE_FORMAT_DOT: 4}
+CLOCK_LENGTH = len(', HH:MM')  # the time of a message ends with the hour and minute, after its date
+DATE_CACHE_SIZE = 4096  # distinct dates kept by _parse_date - all the messages of a day share one
+EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+DEFAULT_CHUNKSIZE = 100000  # lines per chunk in read_file_chunked
+
+BOM = codecs.BOM_UTF8  # some exports start with a byte order mark, which is not part of the first line
+# bidirectional marks - phone numbers in sender names are wrapped in them, e.g. u'\u202a+972 50-686-1962\u202c'
+DIRECTION_MARKS = u'\u200e\u200f\u202a\u202b\u202c\u202d\u202e'
+
+HASH_COL = 'message_hash'  # stored by MessageDatabase.save next to the message columns
+STORE_METADATA_KEY = 'message_database'
+TEXT_INDEX_SUFFIX = '.text_index'  # appended to the path of a saved database for the file of its text index
+
+PUNCTUATION_MARKS = '?!'  # special punctuation counted by MessageDatabase._count_special_punctuation
+
+# granularity of activity rollups -> pandas frequency of its time periods (months are handled as calendar periods)
+ROLLUP_GRANULARITIES = {'hour': 'h', 'day': 'D', 'month': 'MS'}
+ROLLUP_COLUMNS = ['messages', 'words', 'punctuation']
+
+SESSION_GAP_MINUTES = 60  # default gap between messages that splits them into different sessions, see sessions
+SESSION_COLUMNS = ['start', 'end', 'duration_minutes', 'messages', 'participants', 'starter', 'responses',
+                   'mean_response_minutes']
 
-# STOPWORDS = pd.read_csv(path.join(PATH_TO_DATA, 'stopwords.csv'), encoding='ANSI')
-# STOPWORDS = STOPWORDS[STOPWORDS['POS'] == 'preposition']['Undotted']
+CHECKPOINT_BLOCK_SIZE = 64 * 1024  # bytes read from the end of a file at a time when looking for its last message
 
 
-def parse_message(msg):
+def load_stopwords(path_to_file=None, encoding=STOPWORDS_ENCODING):
+    """
+    Returns the stopwords - the undotted prepositions in the stopwords file. The file is read once, on first call,
+    and the stopwords are kept for later calls.
+    :param path_to_file: string, path of the stopwords csv file, defaults to STOPWORDS_FILE in PATH_TO_DATA. If
+        given, the file is read even if stopwords were loaded before.
+    :param encoding: string, encoding of the file
+    :return: frozenset of strings
+    """
+    global _stopwords
+    if _stopwords is None or path_to_file is not None:
+        if path_to_file is None:
+            path_to_file = path.join(PATH_TO_DATA, STOPWORDS_FILE)
+        stopwords = pd.read_csv(path_to_file, encoding=encoding)
+        _stopwords = frozenset(stopwords[stopwords['POS'] == 'preposition']['Undotted'])
+    return _stopwords
+
+
+def parse_message(msg, date_format=None):
     """
     Parses message - time, sender and content.
     Hard-coded for WhatsApp format - "mm/dd/yy, HH:MM - <sender>: <content>"
     :param msg: string
+    :param date_format: DATE_FORMAT_SLASH or DATE_FORMAT_DOT, the date format of the file (see sniff_date_format) -
+        if None, or if the time of msg is not in it, the format is detected from the time
     :return: time (datetime), sender (string) and content (string)
     """
-    time_sender_pattern = "[0-9]{1,2}[\/\.][0-9]{1,2}[\/\.][0-9]{2,4}, [0-9]{2}:[0-9]{2} - .+: "
-    time_sender_match = re.match(time_sender_pattern, msg)
+    time_sender_match = TIME_SENDER_PATTERN.match(msg)
 
     if time_sender_match is None:
         # This means the current msg does not have time or sender - it is a continuation of previous message
         return None, None, msg
 
-    time_sender_match_group = time_sender_match.group()
-    split_by_dash = time_sender_match_group.split(' - ')
-    msg_time, msg_sender = split_by_dash[0:2]
+    msg_time = time_sender_match.group('time')
+    if date_format is None or DATE_SEPARATORS[date_format] not in msg_time:
+        date_format = _date_format(msg_time)
+
+    year, month, day = _parse_date(msg_time[:-CLOCK_LENGTH], date_format)
+    time = datetime(year, month, day, int(msg_time[-5:-3]), int(msg_time[-2:]))
 
+    sender = time_sender_match.group('sender')
+    content = msg[time_sender_match.end():]
+    return time, sender, content
+
+
+def _date_format(msg_time):
+    """
+    :param msg_time: string, time of a message, or its date part
+    :return: DATE_FORMAT_SLASH or DATE_FORMAT_DOT
+    """
     # this is a heuristic to check if time is in mm/dd/yy format or dd.mm.yyyy format
     if '/' in msg_time:
-        time = datetime.strptime(msg_time, '%m/%d/%y, %H:%M')
-    elif '.' in msg_time:
-        time = datetime.strptime(msg_time, '%d.%m.%Y, %H:%M')
+        return DATE_FORMAT_SLASH
+    if '.' in msg_time:
+        return DATE_FORMAT_DOT
+    raise Exception('Unexpected date and time format - {}'.format(msg_time))
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def _parse_date(date_string, date_format):
+    """
+    Parses the date part of a message time - same result as datetime.strptime, but from the integers between the
+    separators, and cached, as consecutive messages mostly share their date.
+    :param date_string: string, e.g. '1/15/18' or '15.01.2018'
+    :param date_format: DATE_FORMAT_SLASH or DATE_FORMAT_DOT
+    :return: tuple of ints (year, month, day)
+    """
+    parts = date_string.split(DATE_SEPARATORS[date_format])
+    if len(parts) != 3 or len(parts[2]) != YEAR_DIGITS[date_format]:
+        # anything unusual is left to strptime, which raises on what it does not accept
+        date = datetime.strptime(date_string, date_format[:-CLOCK_LENGTH])
+        return date.year, date.month, date.day
+
+    if date_format == DATE_FORMAT_SLASH:
+        month, day, year = int(parts[0]), int(parts[1]), int(parts[2])
+        # the century of two-digit years, as in strptime
+        year += 2000 if year < 69 else 1900
     else:
-        raise Exception('Unexpected date and time format - {}'.format(msg_time))
+        day, month, year = int(parts[0]), int(parts[1]), int(parts[2])
+    datetime(year, month, day)  # raises on dates that do not exist, like strptime
+    return year, month, day
 
-    sender = msg_sender[:-2]  # remove ': ' from end of sender id
-    content = msg[len(time_sender_match_group):]
-    return time, sender, content
 
+def parse_text(text):
+    """
+    Parses the decoded text of a whole export in bulk - same result as calling parse_message on each line and
+    attaching continuation lines to the previous message, but with a single regex pass over the buffer, and only the
+    distinct date and clock parts of the times parsed (with _parse_date and _parse_clock), see _records_to_frame.
+    :param text: string, lines separated by '\n'
+    :return: DataFrame with columns of TIME_COL, SENDER_COL, CONTENT_COL
+    """
+    return _parse_chunk(text)[0]
+
+
+def _parse_chunk(text, previous_header=None):
+    """
+    Parses a piece of an export with parse_text logic. A continuation line at the start of the piece is attached to
+    previous_header, the last message header of the preceding piece.
+    :param text: string, lines separated by '\n'
+    :param previous_header: tuple of strings (time, sender), or None if text is the start of the export
+    :return: tuple of DataFrame with columns of TIME_COL, SENDER_COL, CONTENT_COL, and the last message header in
+        text (or previous_header, if text has no header)
+    """
+    with stage('regex') as stats:
+        records = LINE_PATTERN.findall(text)
+        if text.endswith('\n') or not text:
+            # the pattern also matches the empty string after the last newline, which is not a line of the file
+            records.pop()
+        stats.rows = len(records)
+
+    if records and records[0][0] == '' and previous_header is not None:
+        records[0] = previous_header + records[0][2:]
+
+    last_header = previous_header
+    for record in reversed(records):
+        if record[0] != '':
+            last_header = record[:2]
+            break
+
+    return _records_to_frame(records), last_header
+
+
+def _parse_clock(clock):
+    """
+    :param clock: string, 'HH:MM'
+    :return: int, minute of the day
+    """
+    hour, minute = int(clock[:2]), int(clock[3:])
+    if hour > 23 or minute > 59:
+        raise Exception('Unexpected date and time format - {}'.format(clock))
+    return hour * 60 + minute
+
+
+def _records_to_frame(records):
+    """
+    Converts (time, sender, content) string tuples as matched by LINE_PATTERN into a DataFrame. Continuation lines
+    (empty time and sender) get the time and sender of the previous message.
+    :param records: list of tuples of strings
+    :return: DataFrame with columns of TIME_COL, SENDER_COL, CONTENT_COL
+    """
+    if not records:
+        return _empty_messages()
+
+    with stage('records_frame') as stats:
+        parts = pd.DataFrame.from_records(records, columns=['time', 'sender', 'content'])
+        is_header = parts['time'] != ''
+        stats.rows = len(parts)
+
+    if not is_header.iloc[0]:
+        raise Exception('First line is not a message header - {}'.format(parts['content'].iloc[0]))
+
+    with stage('parse_times') as stats:
+        # a time is a date and a clock, and there are few distinct ones of each - a chat has a date per day and a
+        # clock per minute of the day - so only those are parsed, and the times are put together from them
+        msg_times = parts['time'][is_header]
+        date_codes, dates = pd.factorize(msg_times.str[:-CLOCK_LENGTH])
+        clock_codes, clocks = pd.factorize(msg_times.str[-5:])
+        date_days = np.array([
+            datetime(*_parse_date(date, _date_format(date))).toordinal() - EPOCH_ORDINAL for date in dates
+        ], dtype=np.int64)
+        clock_minutes = np.array([_parse_clock(clock) for clock in clocks], dtype=np.int64)
+        minutes = date_days[date_codes] * 24 * 60 + clock_minutes[clock_codes]
+        time = pd.Series(minutes.astype('datetime64[m]').astype('datetime64[us]'),
+                         index=parts.index[is_header]).reindex(parts.index)
+        stats.rows = len(dates)
+
+    with stage('build_frame') as stats:
+        sender = parts['sender'].where(is_header)
+        df = pd.DataFrame(
+            data={TIME_COL: time.ffill(), SENDER_COL: sender.ffill(), CONTENT_COL: parts['content'].str.strip()},
+        )
+        stats.rows = len(df)
+    return df
 
-def read_file(path_to_file):
+
+def read_file(path_to_file, workers=None):
     """
-    Reads message file, calls parse_message and populates DataFrame.
+    Reads message file in one pass, parses it in bulk with parse_text and populates DataFrame.
+    With workers, the file is split into byte ranges that start at message headers, and the ranges are parsed in
+    parallel in a process pool.
+    :param path_to_file: string
+    :param workers: int, number of processes to parse the file with - if None, the file is parsed in this process
+    :return: DataFrame with columns of TIME_COL, SENDER_COL, CONTENT_COL
+    """
+    with stage('read_file') as stats:
+        if workers is not None and workers > 1:
+            # the ranges are parsed in other processes, so only the whole stage is measured
+            offsets = _split_offsets(path_to_file, workers)
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                dfs = list(executor.map(partial(_read_range, path_to_file), offsets[:-1], offsets[1:]))
+            df = pd.concat(dfs, ignore_index=True)
+        else:
+            with stage('decode'):
+                text = _decode_file(path_to_file)
+            df = parse_text(text)
+        stats.rows = len(df)
+    return df
+
+
+def _decode_file(path_to_file, start=0, end=None):
+    """
+    Decodes the bytes of file between start and end in a single pass over a memory map of the file, so the bytes are
+    not copied into memory first. A byte order mark at the start of the file is skipped.
+    :param path_to_file: string
+    :param start: int, offset of the first byte
+    :param end: int, offset after the last byte, defaults to the end of the file
+    :return: string
+    """
+    with open(path_to_file, 'rb') as f:
+        size = path.getsize(path_to_file)
+        end = size if end is None else end
+        if end <= start:
+            return u''
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if start == 0 and mapped[:len(BOM)] == BOM:
+                start = len(BOM)
+            with memoryview(mapped) as data:
+                return str(data[start:end], 'utf-8')
+        finally:
+            mapped.close()
+
+
+def _split_offsets(path_to_file, parts):
+    """
+    Splits a file into about equal byte ranges. Each split point is moved forward to the start of the next message
+    header line, so no message is cut between ranges.
+    :param path_to_file: string
+    :param parts: int, number of ranges to aim for
+    :return: sorted list of distinct offsets, starting with 0 and ending with the file size
+    """
+    size = path.getsize(path_to_file)
+    offsets = [0]
+    with open(path_to_file, 'rb') as f:
+        for part in range(1, parts):
+            f.seek(max(size * part // parts, offsets[-1]))
+            f.readline()  # skip to the start of the next line
+            offset = f.tell()
+            for line in iter(f.readline, b''):
+                if TIME_SENDER_PATTERN.match(str(line, 'utf-8')):
+                    break
+                offset = f.tell()
+            if offsets[-1] < offset < size:
+                offsets.append(offset)
+    offsets.append(size)
+    return offsets
+
+
+def _read_range(path_to_file, start, end):
+    """
+    Parses the bytes of file between start and end, which must start with a message header.
+    :param path_to_file: string
+    :param start: int, offset of the first byte
+    :param end: int, offset after the last byte
+    :return: DataFrame with columns of TIME_COL, SENDER_COL, CONTENT_COL
+    """
+    return parse_text(_decode_file(path_to_file, start, end))
+
+
+def read_file_chunked(path_to_file, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Reads message file in chunks of chunksize lines, so only one chunk of raw text is held in memory at a time.
+    The last time and sender of each chunk are carried to the next one, so continuation lines at the start of a chunk
+    are attached to the right message. Concatenating the chunks gives the same DataFrame as read_file.
+    :param path_to_file: string
+    :param chunksize: int, number of lines (and therefore rows) per chunk
+    :return: generator of DataFrames with columns of TIME_COL, SENDER_COL, CONTENT_COL
+    """
+    return _read_chunks(path_to_file, chunksize)
+
+
+def _read_chunks(path_to_file, chunksize, start=0, end=None):
+    """
+    read_file_chunked, of the bytes of file between start and end.
+    :param path_to_file: string
+    :param chunksize: int, number of lines per chunk
+    :param start: int, offset of the first byte - the start of a message header line
+    :param end: int, offset after the last byte - the end of a line, defaults to the end of the file
+    :return: generator of DataFrames with columns of TIME_COL, SENDER_COL, CONTENT_COL
+    """
+    last_header = None
+    row_count = 0
+    with open(path_to_file, 'rb') as f:
+        f.seek(start)
+        lines_to_read = iter(f) if end is None else _lines_until(f, end)
+        while True:
+            with stage('read'):
+                lines = list(islice(lines_to_read, chunksize))
+            if not lines:
+                break
+            if row_count == 0 and lines[0].startswith(BOM):
+                lines[0] = lines[0][len(BOM):]
+            with stage('decode'):
+                text = str(b''.join(lines), 'utf-8')
+            chunk, last_header = _parse_chunk(text, last_header)
+            chunk.index += row_count
+            row_count += len(chunk)
+            yield chunk
+
+
+def _lines_until(f, end):
+    """
+    :param f: file opened in binary mode
+    :param end: int, offset of the end of a line
+    :return: generator of the lines of f from its current offset up to end
+    """
+    offset = f.tell()
+    for line in f:
+        if offset >= end:
+            break
+        offset += len(line)
+        yield line
+
+
+def _concat_chunks(chunks):
+    """
+    :param chunks: iterable of DataFrames, as generated by read_file_chunked
+    :return: DataFrame, the chunks one after the other
+    """
+    chunks = list(chunks)
+    return pd.concat(chunks) if chunks else _empty_messages()
+
+
+def _last_line_end(f, start):
+    """
+    Finds the end of the last complete line of a file, reading it backwards from its end.
+    :param f: file opened in binary mode
+    :param start: int, offset to search from
+    :return: int, offset after the last '\n' of f after start, or start if there is none
+    """
+    f.seek(0, 2)
+    block_end = f.tell()
+    while block_end > start:
+        block_start = max(start, block_end - CHECKPOINT_BLOCK_SIZE)
+        f.seek(block_start)
+        newline = f.read(block_end - block_start).rfind(b'\n')
+        if newline >= 0:
+            return block_start + newline + 1
+        block_end = block_start
+    return start
+
+
+def iter_messages(path_to_file, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Iterates over the messages in file, reading it with read_file_chunked.
+    :param path_to_file: string
+    :param chunksize: int, number of lines read and parsed at a time
+    :return: generator of tuples (time, sender, content)
+    """
+    for chunk in read_file_chunked(path_to_file, chunksize=chunksize):
+        for message in chunk.itertuples(index=False, name=None):
+            yield message
+
+
+def file_checkpoint(path_to_file):
+    """
+    Finds the last message of a file - the offset of its header line and of the end of its last complete line - and
+    fingerprints its bytes. Only the end of the file is read.
+    :param path_to_file: string
+    :return: dict with 'message_offset', 'end_offset' and 'fingerprint', or None if the file has no complete
+        message header line
+    """
+    with open(path_to_file, 'rb') as f:
+        f.seek(0, 2)
+        size = f.tell()
+        block_size = CHECKPOINT_BLOCK_SIZE
+        while True:
+            start = max(0, size - block_size)
+            f.seek(start)
+            data = f.read(size - start)
+            end = data.rfind(b'\n') + 1  # only complete lines count, the last line may still be written
+
+            # walk back over the complete lines - the first line of the block is complete only at start of file
+            line_end = end
+            while line_end > 0:
+                line_start = data.rfind(b'\n', 0, line_end - 1) + 1
+                if line_start == 0 and start > 0:
+                    break
+                # utf-8-sig, as the first line may start with a byte order mark
+                if TIME_SENDER_PATTERN.match(str(data[line_start:line_end], 'utf-8-sig')):
+                    return {
+                        'message_offset': start + line_start,
+                        'end_offset': start + end,
+                        'fingerprint': hashlib.sha1(data[line_start:end]).hexdigest(),
+                    }
+                line_end = line_start
+
+            if start == 0:
+                return None
+            block_size *= 2
+
+
+def read_file_from_checkpoint(path_to_file, checkpoint, chunksize=None):
+    """
+    Reads only the part of a file from the last message recorded in checkpoint onwards, after checking that message
+    is unchanged. Meant for re-exports of the same chat, which extend the previous export.
+    Like file_checkpoint, only complete lines are read - a last line without a newline may still be written, and is
+    read once it is complete.
+    :param path_to_file: string
+    :param checkpoint: dict, as returned by file_checkpoint for a previous version of the file
+    :param chunksize: int, if given the file is read in chunks of that many lines (see read_file_chunked)
+    :return: DataFrame with columns of TIME_COL, SENDER_COL, CONTENT_COL - starting with the checkpoint message,
+        or None if the file no longer matches the checkpoint
+    """
+    start = checkpoint['message_offset']
+    with stage('read_file_from_checkpoint') as stats:
+        with open(path_to_file, 'rb') as f:
+            f.seek(start)
+            last_message = f.read(checkpoint['end_offset'] - start)
+            if hashlib.sha1(last_message).hexdigest() != checkpoint['fingerprint']:
+                return None
+        df = _read_complete_lines(path_to_file, start, chunksize=chunksize)
+        stats.rows = len(df)
+    return df
+
+
+def read_new_messages(path_to_file, checkpoint=None, chunksize=None):
+    """
+    Reads the messages of a file that may have been read before - from its checkpoint if the file is unchanged up to
+    there, or else all of it. The new checkpoint is taken before reading, so if the file grows while it is read, the
+    next read starts at or before the end of what was read here. Either way only complete lines are read, as the
+    checkpoint counts only complete lines - a last line without a newline is read once it is complete.
+    :param path_to_file: string
+    :param checkpoint: dict or None, checkpoint of the previous read of the file (see file_checkpoint)
+    :param chunksize: int, if given the file is read in chunks of that many lines (see read_file_chunked)
+    :return: tuple of DataFrame with columns of TIME_COL, SENDER_COL, CONTENT_COL, and the new checkpoint
+    """
+    new_checkpoint = file_checkpoint(path_to_file)
+    new_df = None
+    if checkpoint is not None:
+        new_df = read_file_from_checkpoint(path_to_file, checkpoint, chunksize=chunksize)
+    if new_df is None:
+        with stage('read_file') as stats:
+            new_df = _read_complete_lines(path_to_file, chunksize=chunksize)
+            stats.rows = len(new_df)
+    return new_df, new_checkpoint
+
+
+def _read_complete_lines(path_to_file, start=0, chunksize=None):
+    """
+    Parses the complete lines of a file from start onwards - a last line without a newline may still be written.
+    :param path_to_file: string
+    :param start: int, offset of the start of a message header line
+    :param chunksize: int, if given the file is read in chunks of that many lines (see read_file_chunked)
+    :return: DataFrame with columns of TIME_COL, SENDER_COL, CONTENT_COL
+    """
+    with open(path_to_file, 'rb') as f:
+        end = _last_line_end(f, start)
+    if chunksize is not None:
+        return _concat_chunks(_read_chunks(path_to_file, chunksize, start, end))
+    with stage('decode'):
+        text = _decode_file(path_to_file, start, end)
+    return parse_text(text)
+
+
+def sniff_date_format(text):
+    """
+    Detects the date format of an export from its first message header, so it is not detected again for each
+    message (see parse_message). Used by read_file_per_line - the bulk parser detects the format of each distinct
+    date instead, see _records_to_frame.
+    :param text: string, the start of the export
+    :return: DATE_FORMAT_SLASH or DATE_FORMAT_DOT
+    """
+    time_sender_match = TIME_SENDER_PATTERN.match(text)
+    if time_sender_match is None:
+        raise Exception('First line is not a message header - {}'.format(text.split('\n', 1)[0]))
+    return _date_format(time_sender_match.group('time'))
+
+
+def read_file_per_line(path_to_file):
+    """
+    Reads message file line by line, calls parse_message and populates DataFrame.
+    Reference implementation of read_file - kept for benchmarking and for checking the bulk parser against it.
     :param path_to_file: string
     :return: DataFrame with columns of TIME_COL, SENDER_COL, CONTENT_COL
     """
 
     data_list = []  # will be a list of tuples (time, sender, content)
+    date_format = None
 
     with open(path_to_file, 'rb') as f:
         for line in f:
-            time, sender, content = parse_message(str(line, 'utf-8'))
+            line = str(line, 'utf-8')
+            if date_format is None:
+                line = line.lstrip(u'\ufeff')
+                date_format = sniff_date_format(line)
+            time, sender, content = parse_message(line, date_format)
             if time is None and sender is None:
                 # this message is a continuation of previous message, copy last time and sender
                 time, sender = data_list[-1][0:2]
@@ -68,101 +568,760 @@ def read_file(path_to_file):
     )
 
 
+def _empty_messages():
+    """
+    :return: DataFrame with columns of TIME_COL, SENDER_COL, CONTENT_COL and no rows, senders as a categorical
+    """
+    return pd.DataFrame(data={
+        TIME_COL: pd.Series([], dtype='datetime64[us]'),  # the resolution of parsed times, see _records_to_frame
+        SENDER_COL: _encode_senders(pd.Series([], dtype=str)),
+        CONTENT_COL: pd.Series([], dtype=str),
+    })
+
+
+def _encode_senders(senders, categories=()):
+    """
+    Converts senders to a categorical, whose categories are categories, in order, followed by the senders that are
+    not in them (sorted, unless senders is already a categorical). Categories are only appended, so codes stay valid
+    when senders are added, and a sender is renamed by renaming its category (see MessageDatabase.map_senders).
+    A chat has few distinct senders, so this stores one small integer code per message instead of a string.
+    :param senders: Series of strings, or categorical
+    :param categories: Index or list of strings, categories to keep even if not in senders
+    :return: categorical Series
+    """
+    categories = list(categories)
+    known = set(categories)
+    if isinstance(senders.dtype, pd.CategoricalDtype):
+        new_categories = [sender for sender in senders.cat.categories if sender not in known]
+    else:
+        new_categories = sorted(set(senders.dropna().unique()) - known)
+    all_categories = categories + new_categories
+    if isinstance(senders.dtype, pd.CategoricalDtype) and list(senders.cat.categories) == all_categories:
+        return senders
+    return pd.Series(pd.Categorical(senders, categories=all_categories), index=senders.index, name=senders.name)
+
+
+def _mapped_sender(sender, mapping_dictionary):
+    """
+    :param sender: string
+    :param mapping_dictionary: dict, see MessageDatabase.map_senders
+    :return: string, the value of sender in mapping_dictionary - looked up as is, and then without the direction marks
+        around phone numbers - or sender if it is not mapped
+    """
+    return mapping_dictionary.get(sender, mapping_dictionary.get(sender.strip(DIRECTION_MARKS), sender))
+
+
+def _time_slice(df, start=None, end=None):
+    """
+    Returns the rows of df with time between start and end (inclusive), found by binary search - a slice of df,
+    not a copy.
+    :param df: DataFrame, sorted by TIME_COL
+    :param start: datetime, defaults to the first row
+    :param end: datetime, defaults to the last row
+    :return: DataFrame
+    """
+    times = df[TIME_COL]
+    first = 0 if start is None else times.searchsorted(start, side='left')
+    last = len(df) if end is None else times.searchsorted(end, side='right')
+    return df.iloc[first:last]
+
+
+def _period_start(times, granularity):
+    """
+    :param times: Series of datetimes
+    :param granularity: string, one of ROLLUP_GRANULARITIES
+    :return: Series of datetimes, the start of the hour, day or month of each time
+    """
+    if granularity == 'month':
+        return times.dt.to_period('M').dt.to_timestamp().values
+    return times.dt.floor(ROLLUP_GRANULARITIES[granularity]).values
+
+
+def _rollup_messages(df, words, punctuation, granularity):
+    """
+    Counts messages, words and special punctuation marks per time period and sender.
+    :param df: DataFrame with columns of TIME_COL and SENDER_COL
+    :param words: Series of word counts per message of df
+    :param punctuation: Series of special punctuation counts per message of df
+    :param granularity: string, one of ROLLUP_GRANULARITIES
+    :return: DataFrame indexed by (period start, sender), sorted, with columns of ROLLUP_COLUMNS
+    """
+    counts = pd.DataFrame(data={
+        'period': _period_start(df[TIME_COL], granularity),
+        SENDER_COL: np.asarray(df[SENDER_COL], dtype=object),
+        'messages': 1,
+        'words': words.values,
+        'punctuation': punctuation.values,
+    })
+    return counts.groupby(['period', SENDER_COL], sort=True)[ROLLUP_COLUMNS].sum().astype(np.int64)
+
+
+def _segment_sessions(df, gap_minutes, first_session=0):
+    """
+    Splits messages into sessions - a new session starts wherever a message comes more than gap_minutes after the
+    one before it. Gaps are found with a diff of the time column, and session ids with a cumulative sum over the
+    session starts.
+    :param df: DataFrame with columns of TIME_COL and SENDER_COL, sorted by time
+    :param gap_minutes: number
+    :param first_session: int, id of the session of the first message
+    :return: tuple of numpy array of the session id of each message, and DataFrame of session stats indexed by
+        session id, with columns of SESSION_COLUMNS (see MessageDatabase.sessions)
+    """
+    times = df[TIME_COL].values
+    gaps = np.diff(times)
+    is_start = np.ones(len(times), dtype=bool)
+    is_start[1:] = gaps > pd.Timedelta(minutes=gap_minutes).to_timedelta64()
+    local_ids = np.cumsum(is_start) - 1
+
+    starts = np.flatnonzero(is_start)
+    ends = np.append(starts[1:], len(times))[:len(starts)] - 1
+    codes, uniques = pd.factorize(df[SENDER_COL])
+
+    # a distinct (session, sender) pair per participant of each session
+    pairs = np.unique(local_ids * max(len(uniques), 1) + codes)
+    participants = np.bincount(pairs // max(len(uniques), 1), minlength=len(starts))
+
+    # a response is a message in the same session as the one before it, from another sender
+    is_response = np.zeros(len(times), dtype=bool)
+    is_response[1:] = ~is_start[1:] & (codes[1:] != codes[:-1])
+    latencies = np.zeros(len(times))
+    latencies[1:] = gaps / np.timedelta64(1, 'm')
+    responses = np.bincount(local_ids[is_response], minlength=len(starts))
+    total_latency = np.bincount(local_ids[is_response], weights=latencies[is_response], minlength=len(starts))
+
+    stats = pd.DataFrame(
+        data={
+            'start': times[starts],
+            'end': times[ends],
+            'duration_minutes': (times[ends] - times[starts]) / np.timedelta64(1, 'm'),
+            'messages': ends - starts + 1,
+            'participants': participants,
+            'starter': np.asarray(df[SENDER_COL].values[starts], dtype=object),
+            'responses': responses,
+            'mean_response_minutes': np.divide(total_latency, responses, out=np.full(len(starts), np.nan),
+                                               where=responses > 0),
+        },
+        index=pd.RangeIndex(first_session, first_session + len(starts), name='session'),
+    )
+    return local_ids + first_session, stats
+
+
 class MessageDatabase(object):
-    def __init__(self, path_to_file):
-        self.df = read_file(path_to_file)
+    # format version written by save, checked by load
+    STORE_VERSION = 1
+
+    # feature name (and name of the column added by add_information) -> method computing it
+    FEATURES = {
+        'word_count': '_count_words',
+        'word_count_without_stopwords': '_count_words_without_stopwords',
+        'punctuation_count': '_count_special_punctuation',
+        'time_bin': '_time_bin',
+        'time_diff': '_time_diff',
+        'session_id': '_session_id',
+    }
+    # feature name -> columns it is computed from
+    FEATURE_INPUTS = {
+        'word_count': [CONTENT_COL],
+        'word_count_without_stopwords': [CONTENT_COL],
+        'punctuation_count': [CONTENT_COL],
+        'time_bin': [TIME_COL],
+        'time_diff': [TIME_COL],
+        'session_id': [TIME_COL],
+    }
+    # features that depend only on their own message - their method takes a df argument, so the cache can be
+    # extended with new messages instead of recomputed
+    MESSAGE_FEATURES = {'word_count', 'word_count_without_stopwords', 'punctuation_count', 'time_bin'}
+
+    def __init__(self, path_to_file=None, chunksize=None):
+        """
+        :param path_to_file: string, path to file in correct format. If None, the database starts empty.
+        :param chunksize: int, if given the file is read in chunks of that many lines (see read_file_chunked), to
+            bound the memory used while parsing large exports
+        """
+        self.df = _empty_messages()
         self.mapping_dictionary = {}
+        self.source_files = {}  # path of each file added to the database -> dict of metadata on that file
+        # hashes of the messages as they were read (see _hash_messages) - kept when senders are mapped, so messages
+        # read again are still found
+        self._row_hashes = np.array([], dtype=np.uint64)  # hash of each row of self.df
+        self._message_hashes = set()
+        self._features = {}  # feature name -> cached Series, see feature
+        self._rollups = {}  # granularity -> activity counts per time period and sender, see activity
+        self._sessions = {}  # gap in minutes -> session id of each message and stats per session, see sessions
+        self.text_index = None  # TextIndex over message contents, built on first search
+        self.version = 0  # number of changes to the database, see snapshot
+
+        self._write_lock = threading.RLock()  # held by changes to the database, not while files are parsed
+        self._write_depth = 0  # nesting of _writing
+        self._snapshot = None  # MessageSnapshot of the current state, once one was taken
+
+        if path_to_file is not None:
+            # the checkpoint is taken before the file is read, see read_new_messages
+            df, checkpoint = read_new_messages(path_to_file, chunksize=chunksize)
+            self._set_messages(df)
+            self._record_source_file(path_to_file, len(df), checkpoint)
 
-    def add_from_file(self, path_to_file):
+    @classmethod
+    def from_files(cls, paths_to_files, workers=None, chunksize=None):
         """
-        Adds messages from file path_to_file. Checks for overlap and only adds unique messages.
-        Sorts by time and resets index when done.
-        Assumption - the new file is consistent, meaning the message time is monotonic (non-decreasing).
+        Creates a database from several files, parsing them in parallel in a process pool and then merging them
+        all at once. The result is the same as creating the database from the first file and calling add_from_file
+        with the others, in order - or an empty database if there are no files.
+        :param paths_to_files: list of strings, paths to files in correct format
+        :param workers: int, number of processes - defaults to the number of CPUs
+        :param chunksize: int, if given each file is read in chunks of that many lines (see read_file_chunked)
+        :return: MessageDatabase
+        """
+        if not paths_to_files:
+            return cls()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            dfs, checkpoints = zip(*executor.map(partial(read_new_messages, chunksize=chunksize), paths_to_files))
+
+        db = cls()
+        db._set_messages(dfs[0])
+        db._add_messages(dfs[1:])
+        for path_to_file, df, checkpoint in zip(paths_to_files, dfs, checkpoints):
+            db._record_source_file(path_to_file, len(df), checkpoint)
+        return db
+
+    def snapshot(self):
+        """
+        Returns a read-only view of the database as it is now, for reading from other threads while messages are
+        added. Changes to the database build their new state aside and publish a new snapshot when they are done, so
+        a snapshot never sees a change half way, and taking one does not wait for a change in progress (except the
+        first time). The snapshot of an unchanged database is the same object, so taking it is cheap.
+        :return: MessageSnapshot
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._write_lock:
+                if self._snapshot is None:
+                    self._snapshot = MessageSnapshot(self)
+                snapshot = self._snapshot
+        return snapshot
+
+    @contextmanager
+    def _writing(self):
+        """
+        Wraps every change to the database. Changes are serialized with a lock. If a snapshot of the current state was
+        taken, the objects it shares with the database and that are changed in place are copied first - the frame
+        (shallow, so only the columns that change are copied), the metadata dicts and the text index - and a new
+        snapshot is published at the end of the outermost change.
+        """
+        with self._write_lock:
+            self._write_depth += 1
+            is_shared = self._write_depth == 1 and self._snapshot is not None
+            try:
+                if is_shared:
+                    self.df = self.df.copy(deep=False)
+                    self.mapping_dictionary = dict(self.mapping_dictionary)
+                    self.source_files = dict(self.source_files)
+                    if self.text_index is not None:
+                        self.text_index = self.text_index.copy()
+                yield
+            finally:
+                self._write_depth -= 1
+                if self._write_depth == 0:
+                    self.version += 1
+                    if is_shared:
+                        self._snapshot = MessageSnapshot(self)
+
+    def _set_messages(self, df):
+        """
+        Replaces the messages in the database with df, sorted by time (keeping the order of messages with the same
+        time), and senders stored as a categorical. Later merges keep this order, and between and _merge_order rely
+        on it.
+        :param df: DataFrame with columns of TIME_COL, SENDER_COL, CONTENT_COL
+        """
+        df = MessageDatabase._sort_by_time(df).reset_index(drop=True)
+        with self._writing():
+            self._row_hashes = MessageDatabase._hash_messages(df)
+            self._message_hashes = set(self._row_hashes.tolist())
+            df[SENDER_COL] = _encode_senders(df[SENDER_COL])
+            self.df = df
+            self._features = {}
+            self._rollups = {}
+            self._sessions = {}
+            self.text_index = None
+
+    def add_from_file(self, path_to_file, chunksize=None):
+        """
+        Adds messages from file path_to_file. Only adds unique messages - a message is dropped if a message with the
+        same time, sender and content is already in the database, whatever the overlap between the time ranges.
+        New messages are merged into the database in time order, and the index is reset.
+        If path_to_file was added before and still starts with the same content, only the part after the last
+        message added from it is parsed (see file_checkpoint).
         :param path_to_file: string, path to file in correct format
+        :param chunksize: int, if given the file is read in chunks of that many lines (see read_file_chunked)
         """
-        new_df = read_file(path_to_file)
-        # check overlap between messages before loading (using concat problematic, as no keys are available
-        # and message time sender and content must be checked)
+        checkpoint = self.source_files.get(path_to_file, {}).get('checkpoint')
+        with stage('add_from_file') as stats:
+            # the file is parsed before taking the write lock - readers are only held up while it is merged
+            new_df, new_checkpoint = read_new_messages(path_to_file, checkpoint, chunksize=chunksize)
+            self.add_read_messages(path_to_file, new_df, new_checkpoint)
+            stats.rows = len(new_df)
 
-        # check time overlap
-        new_start_time = new_df[TIME_COL].iloc[0]
-        new_end_time = new_df[TIME_COL].iloc[-1]
+    def add_read_messages(self, path_to_file, new_df, checkpoint):
+        """
+        Adds messages that were read from path_to_file with read_new_messages - the second half of add_from_file, for
+        callers that read files elsewhere (e.g. in a worker thread) and add them here.
+        :param path_to_file: string
+        :param new_df: DataFrame with columns of TIME_COL, SENDER_COL, CONTENT_COL
+        :param checkpoint: dict or None, the checkpoint returned with new_df by read_new_messages
+        """
+        with self._writing():
+            self._add_messages([new_df])
+            self._record_source_file(path_to_file, len(new_df), checkpoint)
 
-        curr_start_time = self.df[TIME_COL].iloc[0]
-        curr_end_time = self.df[TIME_COL].iloc[-1]
+    def _add_messages(self, new_dfs):
+        """
+        Adds the messages in new_dfs that are not in the database yet, keeping the database sorted by time.
+        The frames are deduplicated in order - a message in a frame is dropped if it is in the database or in one of
+        the frames before it - and then merged into the database in a single pass.
+        If no message is new, the database is not changed - it keeps its version and snapshot.
+        :param new_dfs: list of DataFrames with columns of TIME_COL, SENDER_COL, CONTENT_COL
+        """
+        with self._write_lock:
+            rows_to_add = self._new_rows(new_dfs)
+            if len(rows_to_add) == 0:
+                return
+            with self._writing():
+                self._merge_new_rows(rows_to_add)
 
-        # find overlap between current () and new [] - either ( [ ) ] or [ ( ) ] or ( [ ] ) or [ ( ] )
-        # within overlap - check sender and content and only keep new messages with their timestamp
+    def _new_rows(self, new_dfs):
+        """
+        Deduplicates new messages against the database and each other, and records their hashes. Called with the write
+        lock held.
+        :param new_dfs: list of DataFrames with columns of TIME_COL, SENDER_COL, CONTENT_COL
+        :return: DataFrame, the messages to add, sorted by time, with their hashes in HASH_COL
+        """
+        rows_to_add = []
+        with stage('dedup') as stats:
+            for new_df in new_dfs:
+                # one hash lookup per new message - the hashes of the current messages are kept in
+                # self._message_hashes
+                new_hashes = MessageDatabase._hash_messages(new_df)
+                new_not_in_curr = np.fromiter((h not in self._message_hashes for h in new_hashes.tolist()),
+                                              dtype=bool, count=len(new_hashes))
+                self._message_hashes.update(new_hashes.tolist())
+                rows_to_add.append(new_df[new_not_in_curr].assign(**{HASH_COL: new_hashes[new_not_in_curr]}))
+            stats.rows = sum(len(new_df) for new_df in new_dfs)
 
-        if new_start_time <= curr_end_time:
-            if new_end_time > curr_end_time:
-                # overlap is between start of new and end of current ( [ ) ]
-                rows_to_add_from_overlap = \
-                    MessageDatabase._return_new_not_in_current_overlap(self.df, new_df, new_start_time, curr_end_time)
-                rows_to_add_from_new = new_df[new_df[TIME_COL] > curr_end_time]
-            else:
-                # new time range is included in current time range ( [ ] )
-                rows_to_add_from_overlap = \
-                    MessageDatabase._return_new_not_in_current_overlap(self.df, new_df, new_start_time, new_end_time)
-                rows_to_add_from_new = pd.DataFrame(data={TIME_COL: [], SENDER_COL: [], CONTENT_COL: []})
-        else:
-            if new_end_time > curr_end_time:
-                # current time range is included in new time range [ ( ) ]
-                rows_to_add_from_overlap = \
-                    MessageDatabase._return_new_not_in_current_overlap(self.df, new_df, curr_start_time, curr_end_time)
-                rows_to_add_from_new = pd.concat([new_df[new_df[TIME_COL] > curr_end_time],
-                                                  new_df[new_df[TIME_COL] < curr_start_time]])
-            else:
-                # overlap is between start of current and end of new [ ( ] )
-                rows_to_add_from_overlap = \
-                    MessageDatabase._return_new_not_in_current_overlap(self.df, new_df, curr_start_time, new_end_time)
-                rows_to_add_from_new = new_df[new_df[TIME_COL] < curr_start_time]
+        rows_to_add = [rows for rows in rows_to_add if len(rows)]
+        if not rows_to_add:
+            return _empty_messages()
+        with stage('sort') as stats:
+            rows_to_add = MessageDatabase._sort_by_time(pd.concat(rows_to_add, ignore_index=True))
+            stats.rows = len(rows_to_add)
+        return rows_to_add
+
+    def _merge_new_rows(self, rows_to_add):
+        """
+        Merges deduplicated messages into the database, and extends what is derived from the messages. Called inside
+        _writing.
+        :param rows_to_add: DataFrame, as returned by _new_rows
+        """
+        new_hashes = rows_to_add.pop(HASH_COL)
+        senders = rows_to_add[SENDER_COL]
+        if self.mapping_dictionary:
+            # new messages get the senders the current messages were mapped to - each distinct sender is mapped once
+            codes, distinct_senders = pd.factorize(senders)
+            mapped = np.array([_mapped_sender(sender, self.mapping_dictionary) for sender in distinct_senders] + [None],
+                              dtype=object)  # code -1 (missing) stays missing
+            senders = pd.Series(mapped[codes], index=senders.index, name=senders.name)
+        # both sides need the same sender categories to be merged as a categorical - new senders are appended, so the
+        # codes of the current messages do not change
+        current_categories = self.df[SENDER_COL].cat.categories
+        senders = _encode_senders(senders, current_categories)
+        if len(senders.cat.categories) != len(current_categories):
+            self.df[SENDER_COL] = self.df[SENDER_COL].cat.add_categories(
+                senders.cat.categories[len(current_categories):])
+        rows_to_add[SENDER_COL] = senders
+
+        with stage('merge') as stats:
+            order = MessageDatabase._merge_order(self.df[TIME_COL], rows_to_add[TIME_COL])
+            self.df = MessageDatabase._take_merged(self.df, rows_to_add, order)
+            self._row_hashes = MessageDatabase._take_merged(pd.Series(self._row_hashes), new_hashes, order).values
+            stats.rows = len(self.df)
+        with stage('extend_derived') as stats:
+            self._extend_sessions(order)
+            self._extend_features(rows_to_add, order)
+            self._extend_rollups(rows_to_add)
+            if self.text_index is not None:
+                self.text_index.extend(rows_to_add[CONTENT_COL], order)
+            stats.rows = len(rows_to_add)
 
-        self.df = pd.concat([self.df, rows_to_add_from_overlap, rows_to_add_from_new], ignore_index=True)
-        self.df.sort_values(TIME_COL, inplace=True)
-        self.df.reindex()
+    def _record_source_file(self, path_to_file, message_count, checkpoint=None):
+        """
+        Updates self.source_files with the file that was just read, including its checkpoint for the next read.
+        :param path_to_file: string
+        :param message_count: int, number of messages read from the file
+        :param checkpoint: dict or None, checkpoint of the file taken before it was read - defaults to a checkpoint
+            of the file as it is now
+        """
+        self.source_files[path_to_file] = {
+            'size': path.getsize(path_to_file),
+            'messages': message_count,
+            'added_at': datetime.now().isoformat(),
+            'checkpoint': file_checkpoint(path_to_file) if checkpoint is None else checkpoint,
+        }
+
+    @staticmethod
+    def _sort_by_time(df):
+        """
+        :param df: DataFrame
+        :return: df sorted by TIME_COL, keeping the order of messages with the same time
+        """
+        if df[TIME_COL].is_monotonic_increasing:
+            return df
+        return df.sort_values(TIME_COL, kind='mergesort')
 
     @staticmethod
-    def _return_new_not_in_current_overlap(curr_df, new_df, overlap_start, overlap_end):
+    def _merge_order(curr_times, new_times):
         """
-        Returns all rows from new df, within time overlap, that don't appear in current df.
-        :param curr_df: DataFrame
-        :param new_df: DataFrame, may have overlap with curr_df
-        :param overlap_start: timestamp, start of overlap
-        :param overlap_end: timestamp, end of overlap
-        :return: DataFrame, rows from new_df in overlap
+        Finds where new messages go when merged into current messages - after all current messages up to their time.
+        :param curr_times: Series of times, sorted
+        :param new_times: Series of times, sorted
+        :return: numpy array, order[i] is the position in concat([current, new]) of the i-th merged message -
+            or None if the new messages just go after the current ones
         """
-        # create mask of overlap time range in both dfs
-        curr_mask = (curr_df[TIME_COL] >= overlap_start) & (curr_df[TIME_COL] <= overlap_end)
-        new_mask = (new_df[TIME_COL] >= overlap_start) & (new_df[TIME_COL] <= overlap_end)
+        if len(curr_times) == 0 or len(new_times) == 0 or new_times.iloc[0] >= curr_times.iloc[-1]:
+            # common case - all new messages are after the current ones, so just append
+            return None
+
+        # position of each new message in the merged frame - after all current messages up to its time,
+        # and after the new messages before it
+        new_positions = curr_times.searchsorted(new_times, side='right') + np.arange(len(new_times))
+        is_new = np.zeros(len(curr_times) + len(new_times), dtype=bool)
+        is_new[new_positions] = True
 
-        # extract overlap from both dfs
-        curr_overlap = curr_df.loc[curr_mask]
-        new_overlap = new_df.loc[new_mask]
+        order = np.empty(len(is_new), dtype=np.int64)
+        order[new_positions] = len(curr_times) + np.arange(len(new_times))
+        order[~is_new] = np.arange(len(curr_times))
+        return order
 
-        # create comparison column - time, sender, content
-        def create_comparison_column(row):
-            return '-'.join([str(row[TIME_COL]), row[SENDER_COL], row[CONTENT_COL]])
+    @staticmethod
+    def _take_merged(curr, new, order):
+        """
+        Merges current and new rows in the order found by _merge_order.
+        :param curr: DataFrame or Series
+        :param new: DataFrame or Series, of the same kind as curr
+        :param order: numpy array or None, as returned by _merge_order
+        :return: DataFrame or Series with a RangeIndex
+        """
+        if len(curr) == 0:
+            return new.reset_index(drop=True)
+        merged = pd.concat([curr, new], ignore_index=True)
+        if order is None:
+            return merged
+        return merged.take(order).reset_index(drop=True)
 
-        # TODO (low priority): solve the SettingWithCopyWarning here
-        curr_overlap['comparison'] = curr_overlap.apply(create_comparison_column, axis=1)
-        new_overlap['comparison'] = new_overlap.apply(create_comparison_column, axis=1)
+    @staticmethod
+    def _hash_messages(df):
+        """
+        Hashes each message by its time, sender and content.
+        :param df: DataFrame with columns of TIME_COL, SENDER_COL, CONTENT_COL
+        :return: numpy array of uint64, one hash per row of df
+        """
+        # hash time as int64 nanoseconds, so the hash doesn't depend on the datetime resolution of the column
+        keys = pd.DataFrame(data={
+            TIME_COL: df[TIME_COL].values.astype('datetime64[ns]').view('int64'),
+            SENDER_COL: df[SENDER_COL].values,
+            CONTENT_COL: df[CONTENT_COL].values,
+        })
+        return pd.util.hash_pandas_object(keys, index=False).values
 
-        # return only rows in new_overlap whose values are NOT in the 'comparison' column of current
-        new_not_in_curr = ~new_overlap['comparison'].isin(curr_overlap['comparison'])
+    def save(self, path_to_store):
+        """
+        Saves the database to a single Arrow (Feather) file - time as int64, sender as categorical, content as
+        strings, plus the message hashes (see _row_hashes). self.mapping_dictionary and self.source_files are saved in the file
+        metadata. If the text index was built, it is saved next to it, in path_to_store + TEXT_INDEX_SUFFIX.
+        Requires pyarrow.
+        :param path_to_store: string, path of the file to write
+        """
+        import pyarrow as pa
+        from pyarrow import feather
 
-        new_overlap = new_overlap[new_not_in_curr]
-        new_overlap.drop('comparison', axis=1, inplace=True)
-        return new_overlap
+        time_unit = np.datetime_data(self.df[TIME_COL].dtype)[0]
+        table = pa.Table.from_pandas(pd.DataFrame(data={
+            TIME_COL: self.df[TIME_COL].values.view('int64'),
+            SENDER_COL: pd.Categorical(self.df[SENDER_COL]),
+            CONTENT_COL: self.df[CONTENT_COL].values,
+            HASH_COL: self._row_hashes,
+        }), preserve_index=False)
+        metadata = {
+            'version': MessageDatabase.STORE_VERSION,
+            'time_unit': time_unit,
+            'mapping_dictionary': self.mapping_dictionary,
+            'source_files': self.source_files,
+            'text_index': self.text_index is not None,
+        }
+        table = table.replace_schema_metadata({STORE_METADATA_KEY: json.dumps(metadata)})
+        # uncompressed, so load can memory-map the file
+        feather.write_feather(table, path_to_store, compression='uncompressed')
+
+        if self.text_index is not None:
+            index_table = pa.Table.from_pandas(self.text_index.to_frame(), preserve_index=False)
+            feather.write_feather(index_table, path_to_store + TEXT_INDEX_SUFFIX, compression='uncompressed')
+
+    @classmethod
+    def load(cls, path_to_store):
+        """
+        Loads a database written by save. The file is memory-mapped, so no text parsing is done. Requires pyarrow.
+        :param path_to_store: string, path of a file written by save
+        :return: MessageDatabase
+        """
+        from pyarrow import feather
+
+        table = feather.read_table(path_to_store, memory_map=True)
+        metadata = json.loads(table.schema.metadata[STORE_METADATA_KEY.encode('utf-8')])
+        if metadata['version'] != MessageDatabase.STORE_VERSION:
+            raise Exception('Unsupported database file version - {}'.format(metadata['version']))
+
+        stored_df = table.to_pandas()
+        db = cls()
+        db.df = pd.DataFrame(data={
+            TIME_COL: stored_df[TIME_COL].values.astype('datetime64[{}]'.format(metadata['time_unit'])),
+            SENDER_COL: _encode_senders(stored_df[SENDER_COL]),
+            CONTENT_COL: stored_df[CONTENT_COL].values,
+        })
+        db.mapping_dictionary = metadata['mapping_dictionary']
+        db.source_files = metadata['source_files']
+        db._row_hashes = stored_df[HASH_COL].values
+        db._message_hashes = set(db._row_hashes.tolist())
+
+        if metadata.get('text_index'):
+            index_frame = feather.read_table(path_to_store + TEXT_INDEX_SUFFIX, memory_map=True).to_pandas()
+            db.text_index = TextIndex.from_frame(index_frame, len(db.df))
+        return db
 
     def map_senders(self, mapping_dictionary):
         """
         Updates self.df[SENDER_COL] column by using the mapping dictionary and replacing its keys with values in
-        that column. Updates self.mapping_dictionary.
+        that column. Senders that are not in the mapping dictionary are kept as they are. A sender wrapped in
+        direction marks (see DIRECTION_MARKS) is also mapped by its key without them. Updates
+        self.mapping_dictionary, which maps senders as they are read to what they are now, and is applied to messages
+        added later - so after map_senders({'bob': 'robert'}) and map_senders({'robert': 'rob'}), bob is mapped to rob.
+        Only the sender categories are relabeled - the per-message codes are rewritten only if several senders are
+        mapped to the same value. Messages are deduplicated by the senders they were read with, so the dedup hashes do
+        not change, and messages read again from a file are still found.
         :param mapping_dictionary: dict, keys are strings to be replaced with values (strings)
         """
-        self.df[SENDER_COL] = self.df[SENDER_COL].map(mapping_dictionary)
-        self.mapping_dictionary.update(mapping_dictionary)
+        with self._writing():
+            senders = self.df[SENDER_COL]
+            # keys may be given without the direction marks around phone numbers
+            mapped_categories = [_mapped_sender(sender, mapping_dictionary) for sender in senders.cat.categories]
+
+            if len(set(mapped_categories)) == len(mapped_categories):
+                self.df[SENDER_COL] = senders.cat.rename_categories(mapped_categories)
+            else:
+                new_categories = list(dict.fromkeys(mapped_categories))  # in the order of the current categories
+                new_code = {sender: code for code, sender in enumerate(new_categories)}
+                code_map = np.array([new_code[sender] for sender in mapped_categories] + [-1])  # -1 stays missing
+                self.df[SENDER_COL] = pd.Series(
+                    pd.Categorical.from_codes(code_map[senders.cat.codes.values], new_categories),
+                    index=senders.index,
+                )
+            # senders that were mapped before are mapped on - mapping_dictionary does not apply to them as read
+            composed = {sender: _mapped_sender(mapped, mapping_dictionary)
+                        for sender, mapped in self.mapping_dictionary.items()}
+            for sender, mapped in mapping_dictionary.items():
+                composed.setdefault(sender, mapped)
+            self.mapping_dictionary = composed
+
+            self._invalidate_features(SENDER_COL)
+            self._rollups = {}
+            self._sessions = {}
+
+    def between(self, start=None, end=None, senders=None):
+        """
+        Returns the messages sent between start and end (inclusive). self.df is sorted by time, so the time range is
+        found by binary search and returned as a slice of self.df, not a copy - unless senders are given.
+        :param start: datetime, defaults to the first message
+        :param end: datetime, defaults to the last message
+        :param senders: list of strings, senders to include, defaults to all
+        :return: DataFrame
+        """
+        messages = _time_slice(self.df, start, end)
+        if senders is not None:
+            messages = messages[messages[SENDER_COL].isin(senders)]
+        return messages
+
+    def build_text_index(self):
+        """
+        Builds an inverted index over message contents, used by search and search_phrase. Once built, the index is
+        updated with every merge of new messages, and saved with the database.
+        """
+        with self._writing():
+            self.text_index = TextIndex(self.df[CONTENT_COL])
+
+    def search(self, terms, operator='and'):
+        """
+        Finds messages whose content contains all (operator 'and') or any (operator 'or') of the terms. Words are
+        matched whole, ignoring case and Hebrew points. Builds the text index if it was not built yet.
+        :param terms: list of strings
+        :param operator: string, 'and' or 'or'
+        :return: DataFrame, the matching messages
+        """
+        if self.text_index is None:
+            self.build_text_index()
+        return self.df.iloc[self.text_index.search(terms, operator=operator)]
+
+    def search_phrase(self, phrase):
+        """
+        Finds messages whose content contains the words of phrase consecutively. Builds the text index if it was not
+        built yet.
+        :param phrase: string
+        :return: DataFrame, the matching messages
+        """
+        if self.text_index is None:
+            self.build_text_index()
+        return self.df.iloc[self.text_index.search_phrase(phrase, self.df[CONTENT_COL])]
+
+    def activity(self, granularity='day', start=None, end=None, senders=None):
+        """
+        Number of messages, words and special punctuation marks per sender per time period. Answered from rollups
+        that are computed on first use for each granularity, and then updated with every merge of new messages.
+        :param granularity: string, one of ROLLUP_GRANULARITIES - 'hour', 'day' or 'month'
+        :param start: datetime, first time period to include (the period containing start), defaults to the first
+        :param end: datetime, last time period to include (the period containing end), defaults to the last
+        :param senders: list of strings, senders to include, defaults to all
+        :return: DataFrame indexed by (period start, sender), with columns of ROLLUP_COLUMNS
+        """
+        rollup = self._rollup(granularity)
+        start = None if start is None else _period_start(pd.Series([start]), granularity)[0]
+        end = None if end is None else _period_start(pd.Series([end]), granularity)[0]
+        # the rollup is sorted by period, so this is a binary search
+        rollup = rollup.loc[start:end]
+        if senders is not None:
+            rollup = rollup[rollup.index.get_level_values(SENDER_COL).isin(senders)]
+        return rollup
+
+    def hour_of_day_activity(self, start=None, end=None, senders=None):
+        """
+        Number of messages, words and special punctuation marks per hour of day (0-23) and sender, between two times.
+        Answered from the hourly rollup, see activity.
+        :param start: datetime, defaults to the first message
+        :param end: datetime, defaults to the last message
+        :param senders: list of strings, senders to include, defaults to all
+        :return: DataFrame indexed by (hour of day, sender), with columns of ROLLUP_COLUMNS
+        """
+        rollup = self.activity('hour', start=start, end=end, senders=senders)
+        hours = rollup.index.get_level_values(0).hour.rename('hour')
+        return rollup.groupby([hours, rollup.index.get_level_values(SENDER_COL)]).sum()
+
+    def build_rollup(self, granularity):
+        """
+        Computes the rollup of a granularity in the database itself, so it is updated with every merge of new
+        messages from then on - a rollup computed by a query on a snapshot is lost at the next change. The current
+        snapshot shares it.
+        :param granularity: string, one of ROLLUP_GRANULARITIES
+        """
+        with self._write_lock:
+            rollup = self._rollup(granularity)
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.version == self.version:
+                # rollups are replaced, not changed, when messages are added
+                snapshot._rollups.setdefault(granularity, rollup)
+
+    def _rollup(self, granularity):
+        """
+        :param granularity: string, one of ROLLUP_GRANULARITIES
+        :return: DataFrame, the (cached) rollup of all messages at that granularity
+        """
+        if granularity not in ROLLUP_GRANULARITIES:
+            raise Exception('Unknown granularity - {}'.format(granularity))
+        if granularity not in self._rollups:
+            self._rollups[granularity] = _rollup_messages(
+                self.df, self.feature('word_count'), self.feature('punctuation_count'), granularity)
+        return self._rollups[granularity]
+
+    def _extend_rollups(self, new_df):
+        """
+        Adds new messages to the cached rollups.
+        :param new_df: DataFrame, messages that were just merged into self.df
+        """
+        if not self._rollups:
+            return
+        words = self._count_words(df=new_df)
+        punctuation = self._count_special_punctuation(df=new_df)
+        for granularity, rollup in self._rollups.items():
+            new_rollup = _rollup_messages(new_df, words, punctuation, granularity)
+            self._rollups[granularity] = rollup.add(new_rollup, fill_value=0).astype(np.int64).sort_index()
+
+    def sessions(self, gap_minutes=SESSION_GAP_MINUTES):
+        """
+        Conversation sessions - runs of messages without a gap of more than gap_minutes between consecutive ones.
+        Computed on first use for each gap, and then updated with every merge of new messages - messages added after
+        the last one only re-segment the last session.
+        :param gap_minutes: number
+        :return: DataFrame indexed by session id, with columns of SESSION_COLUMNS - time of the first and last
+            message, duration in minutes, number of messages, number of senders, sender of the first message, number
+            of responses (messages following a message of another sender) and their mean latency in minutes
+        """
+        return self._session_data(gap_minutes)[1]
+
+    def session_ids(self, gap_minutes=SESSION_GAP_MINUTES):
+        """
+        :param gap_minutes: number, see sessions
+        :return: Series of the session id of each message, aligned with self.df
+        """
+        return pd.Series(self._session_data(gap_minutes)[0], index=self.df.index)
+
+    def response_latencies(self, gap_minutes=SESSION_GAP_MINUTES):
+        """
+        Time senders take to respond to each other - between a message and the one before it, when they are in the
+        same session and from different senders.
+        :param gap_minutes: number, see sessions
+        :return: DataFrame indexed by (sender, replied_to), with columns 'responses', 'mean_minutes', 'median_minutes'
+        """
+        ids = self._session_data(gap_minutes)[0]
+        senders = np.asarray(self.df[SENDER_COL], dtype=object)
+        times = self.df[TIME_COL].values
+        is_response = (ids[1:] == ids[:-1]) & (senders[1:] != senders[:-1])
+        latencies = pd.DataFrame(data={
+            SENDER_COL: senders[1:][is_response],
+            'replied_to': senders[:-1][is_response],
+            'minutes': np.diff(times)[is_response] / np.timedelta64(1, 'm'),
+        })
+        return latencies.groupby([SENDER_COL, 'replied_to'], sort=True)['minutes'].agg(
+            responses='size', mean_minutes='mean', median_minutes='median')
+
+    def _session_data(self, gap_minutes):
+        """
+        :param gap_minutes: number
+        :return: tuple of numpy array of session ids and DataFrame of session stats, as returned by
+            _segment_sessions for all messages (cached)
+        """
+        if gap_minutes not in self._sessions:
+            self._sessions[gap_minutes] = _segment_sessions(self.df, gap_minutes)
+        return self._sessions[gap_minutes]
+
+    def _extend_sessions(self, order):
+        """
+        Updates the cached sessions after new messages were merged into self.df. If they were all added after the
+        current messages, only the last session and the new messages are segmented again, otherwise the cache is
+        dropped.
+        :param order: numpy array or None, as returned by _merge_order
+        """
+        if order is not None:
+            self._sessions = {}
+            return
+        for gap_minutes, (ids, stats) in self._sessions.items():
+            if len(stats) == 0:
+                self._sessions[gap_minutes] = _segment_sessions(self.df, gap_minutes)
+                continue
+            # the new messages may continue the last session
+            last_start = len(ids) - stats['messages'].iloc[-1]
+            tail_ids, tail_stats = _segment_sessions(self.df.iloc[last_start:], gap_minutes, stats.index[-1])
+            self._sessions[gap_minutes] = (np.concatenate([ids[:last_start], tail_ids]),
+                                           pd.concat([stats.iloc[:-1], tail_stats]))
+
+    def memory_usage(self):
+        """
+        :return: int, bytes used by self.df, including the strings it holds
+        """
+        return int(self.df.memory_usage(deep=True).sum())
 
     def show_graphs(self):
         """
@@ -173,49 +1332,143 @@ class MessageDatabase(object):
         # TODO: call them here to create a summary report
         pass
 
-    def add_information(self):
+    def add_information(self, features):
         """
         Adds new columns of information for each message in self.df - number of words, sentiment, translation, etc.
+        Each feature is added as a column with the feature name, see MessageDatabase.FEATURES for the available ones.
+        Translation and sentiment need a translation service and a lexicon, see add_translation and add_sentiment.
+        :param features: list of strings, names of features to add
         """
-        # TODO: implement private methods for different new columns
-        # TODO:(number of words, sentiment, translation, etc.)
-        # TODO: call them here to create new columns
-        pass
+        unknown_features = [feature for feature in features if feature not in MessageDatabase.FEATURES]
+        if unknown_features:
+            raise Exception('Unknown features - {}'.format(', '.join(unknown_features)))
 
-    def _count_words(self, remove_stopwords=False):
+        with stage('add_information') as stats, self._writing():
+            for feature in features:
+                self.df[feature] = self.feature(feature).values
+            stats.rows = len(self.df)
+
+    def add_translation(self, backend, target_language=DEFAULT_TARGET_LANGUAGE, cache=None, **kwargs):
+        """
+        Adds a TRANSLATION_COL column with the translation of each message content. Distinct contents are translated
+        once, in concurrent batches, and cached - see translation.translate_series. Messages added later are not
+        translated until this is called again, which only sends contents that are not in the cache.
+        :param backend: translation.TranslationBackend
+        :param target_language: string, language code
+        :param cache: translation.TranslationCache, optional
+        :param kwargs: batch_size and concurrency, passed to translate_series
+        """
+        self._add_column(TRANSLATION_COL, lambda df: translate_series(
+            df[CONTENT_COL], backend, target_language=target_language, cache=cache, **kwargs))
+
+    def add_sentiment(self, scorer):
+        """
+        Adds a SENTIMENT_COL column with the sentiment score of each message content.
+        :param scorer: sentiment.SentimentScorer
+        """
+        self._add_column(SENTIMENT_COL, lambda df: scorer.score(df[CONTENT_COL]))
+
+    def _add_column(self, column, compute):
+        """
+        Adds a column computed from the messages. It is computed from a snapshot, outside the write lock, as it may be
+        slow - if the database changed in the meantime, it is computed again, inside the lock, for the current
+        messages.
+        :param column: string
+        :param compute: callable, gets a DataFrame of messages and returns a Series aligned with it
+        """
+        snapshot = self.snapshot()
+        values = compute(snapshot.df)
+        with self._writing():
+            if self.version != snapshot.version:
+                values = compute(self.df)
+            self.df[column] = values.values
+
+    def feature(self, name):
+        """
+        Returns a feature of each message in self.df. Features are computed on first access and cached - the cache is
+        extended or invalidated when the messages change, see _extend_features and _invalidate_features.
+        :param name: string, one of MessageDatabase.FEATURES
+        :return: Series of feature values, aligned with self.df
+        """
+        if name not in self._features:
+            with stage('feature_{}'.format(name)) as stats:
+                self._features[name] = getattr(self, MessageDatabase.FEATURES[name])().reset_index(drop=True)
+                stats.rows = len(self.df)
+        return self._features[name]
+
+    def _extend_features(self, new_df, order):
+        """
+        Updates cached features after new_df was merged into self.df. Features that depend only on their own message
+        are computed for the new messages and merged into the cache in the same order; the others are dropped.
+        Feature columns added by add_information are refreshed from the cache.
+        :param new_df: DataFrame, the new messages, sorted by time
+        :param order: numpy array or None, as returned by _merge_order
+        """
+        for name in list(self._features):
+            if name in MessageDatabase.MESSAGE_FEATURES:
+                new_values = getattr(self, MessageDatabase.FEATURES[name])(df=new_df)
+                self._features[name] = MessageDatabase._take_merged(self._features[name], new_values, order)
+            else:
+                del self._features[name]
+
+        for name in MessageDatabase.FEATURES:
+            if name in self.df.columns:
+                self.df[name] = self.feature(name).values
+
+    def _invalidate_features(self, column):
+        """
+        Drops cached features computed from column, after it changed. Feature columns added by add_information are
+        refreshed.
+        :param column: string, one of TIME_COL, SENDER_COL, CONTENT_COL
+        """
+        for name in list(self._features):
+            if column in MessageDatabase.FEATURE_INPUTS[name]:
+                del self._features[name]
+                if name in self.df.columns:
+                    self.df[name] = self.feature(name).values
+
+    def _count_words(self, remove_stopwords=False, df=None):
         """
         Count words in MESSAGE_COL, either with or without stopwords.
-        :param remove_stopwords: whether to remove stopwords - currently not supported
+        Words are separated by single spaces.
+        :param remove_stopwords: whether to remove stopwords (see load_stopwords)
+        :param df: DataFrame to count words in, defaults to self.df
         :return: series of word counts per message
         """
+        df = self.df if df is None else df
+        if not remove_stopwords:
+            return (df[CONTENT_COL].str.count(' ') + 1).rename(None)
 
-        def count(row):
-            return len(row[CONTENT_COL].split(' '))
+        # one word per row, labeled by its message - every message has at least one (maybe empty) word
+        words = df[CONTENT_COL].str.split(' ').explode()
+        is_not_stopword = ~words.isin(load_stopwords())
+        return is_not_stopword.groupby(level=0, sort=False).sum().reindex(df.index).astype(np.int64).rename(None)
 
-        return self.df.apply(count, axis=1)
+    def _count_words_without_stopwords(self, df=None):
+        """
+        Count words in MESSAGE_COL that are not stopwords.
+        :param df: DataFrame to count words in, defaults to self.df
+        :return: series of word counts per message
+        """
+        return self._count_words(remove_stopwords=True, df=df)
 
-    def _count_special_punctuation(self):
+    def _count_special_punctuation(self, df=None):
         """
         Count special punctuation in MESSAGE_COL - ?, !, etc.
+        :param df: DataFrame to count punctuation in, defaults to self.df
         :return: series of punctuation counts per message
         """
-        PUNCTUATION_MARKS = '?!'
-
-        def count(row):
-            return sum([row[CONTENT_COL].count(mark) for mark in PUNCTUATION_MARKS])
-
-        return self.df.apply(count, axis=1)
+        df = self.df if df is None else df
+        return df[CONTENT_COL].str.count('[{}]'.format(re.escape(PUNCTUATION_MARKS))).rename(None)
 
-    def _time_bin(self):
+    def _time_bin(self, df=None):
         """
         Bins time into 1h blocks 00:00-00:59, 01:00-01:59, ... 23:00-23:59
+        :param df: DataFrame to bin times of, defaults to self.df
         :return: series of binned time
         """
-
-        def bin_time(row):
-            return '{}:00'.format(row[TIME_COL].hour)
-
-        return self.df.apply(bin_time, axis=1)
+        df = self.df if df is None else df
+        return (df[TIME_COL].dt.hour.astype(str) + ':00').rename(None)
 
     def _time_diff(self):
         """
@@ -223,12 +1476,52 @@ class MessageDatabase(object):
         First message in database will have NaN.
         :return: series of time differences in minutes between consecutive messages.
         """
+        return (self.df[TIME_COL].diff().dt.total_seconds() / 60).rename(None)
+
+    def _session_id(self):
+        """
+        Session of each message, with the default gap between sessions (see sessions).
+        :return: series of session ids
+        """
+        return self.session_ids()
+
+
+class MessageSnapshot(MessageDatabase):
+    """
+    Read-only view of a MessageDatabase at one point in time, see MessageDatabase.snapshot. All the queries of the
+    database work on it. It shares the messages and the text index with the database, and has its own caches of
+    features, rollups and sessions, so queries on it never see later changes.
+    """
+
+    def __init__(self, db):
+        """
+        :param db: MessageDatabase, called with its write lock held
+        """
+        self.df = db.df
+        self.mapping_dictionary = db.mapping_dictionary
+        self.source_files = db.source_files
+        self._row_hashes = db._row_hashes  # replaced, not changed, when messages are added
+        self._message_hashes = None  # only used when adding messages
+        self._features = dict(db._features)
+        self._rollups = dict(db._rollups)
+        self._sessions = dict(db._sessions)
+        self.text_index = db.text_index
+        self.version = db.version
+
+        self._write_lock = threading.RLock()
+        self._write_depth = 0
+        self._snapshot = self
+
+    def snapshot(self):
+        return self
 
-        diff = self.df[TIME_COL] - self.df[TIME_COL].shift(1)
+    @contextmanager
+    def _writing(self):
+        # the only changes allowed are to the snapshot's own caches, like building its text index
+        yield
 
-        def convert_to_minutes(row):
-            if not isinstance(row, pd.NaT):
-                return row.hour * 60 + row.minute
-            return pd.nan
+    def _read_only(self, *args, **kwargs):
+        raise Exception('A snapshot is read only - change the database it was taken from')
 
-        return diff.apply(convert_to_minutes)
\ No newline at end of file
+    add_from_file = add_read_messages = _add_messages = _set_messages = map_senders = _read_only
+    add_information = add_translation = add_sentiment = _read_only
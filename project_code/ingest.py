@@ -0,0 +1,198 @@
+import asyncio
+import fnmatch
+import logging
+import os
+import time
+
+from project_code.data_prep import read_new_messages
+
+DEFAULT_PATTERN = '*.txt'
+DEFAULT_POLL_INTERVAL = 1.0  # seconds between scans of the directory
+DEFAULT_SETTLE_SECONDS = 2.0  # a file is read only after its size and modification time stay the same this long
+
+logger = logging.getLogger(__name__)
+
+
+class IngestMetrics(object):
+    """
+    Counters of a DirectoryIngest. Latency is measured from when a change of a file is first seen to when its
+    messages are in the database.
+    """
+
+    def __init__(self):
+        self.queue_depth = 0  # files read and waiting to be added
+        self.max_queue_depth = 0
+        self.files_ingested = 0
+        self.files_failed = 0
+        self.rows_read = 0
+        self.rows_added = 0  # rows read that were not in the database yet
+        self.last_latency = None  # seconds
+        self.total_latency = 0.0  # seconds, over all ingested files
+
+    def as_dict(self):
+        """
+        :return: dict, the counters and the mean latency
+        """
+        metrics = dict(vars(self))
+        metrics['mean_latency'] = self.total_latency / self.files_ingested if self.files_ingested else None
+        return metrics
+
+
+class DirectoryIngest(object):
+    """
+    Watches a directory for new and updated exports and adds them to a MessageDatabase, with asyncio:
+    - the directory is polled, and a file is read once it stopped changing (see DEFAULT_SETTLE_SECONDS), so files
+      that are still being written are not read half way
+    - files are read in an executor, off the event loop (with the checkpoint of their previous read, if any)
+    - read files are queued to a single writer task, the only one that changes the database
+        ingest = DirectoryIngest(db, path_to_directory)
+        asyncio.run(ingest.run())  # until ingest.stop() is called
+    """
+
+    def __init__(self, db, path_to_directory, pattern=DEFAULT_PATTERN, poll_interval=DEFAULT_POLL_INTERVAL,
+                 settle_seconds=DEFAULT_SETTLE_SECONDS, executor=None, chunksize=None):
+        """
+        :param db: MessageDatabase to add messages to
+        :param path_to_directory: string
+        :param pattern: string, glob pattern of the names of the files to read
+        :param poll_interval: float, seconds between scans
+        :param settle_seconds: float, seconds a file must stay unchanged before it is read
+        :param executor: concurrent.futures.Executor to read files in, defaults to the default executor of the loop
+        :param chunksize: int, if given files are read in chunks of that many lines (see read_file_chunked)
+        """
+        self.db = db
+        self.path_to_directory = path_to_directory
+        self.pattern = pattern
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.executor = executor
+        self.chunksize = chunksize
+        self.metrics = IngestMetrics()
+
+        self._seen = {}  # path -> (signature, time the signature was first seen)
+        self._ingested = {}  # path -> signature of the last read of the file
+        self._reading = set()  # paths being read or waiting in the queue
+        self._read_tasks = set()
+        self._queue = None
+        self._stopped = None
+
+    async def run(self):
+        """
+        Polls the directory and adds files until stop is called. Files that were read by then are still added.
+        """
+        self._queue = asyncio.Queue()
+        self._stopped = asyncio.Event()
+        writer = asyncio.ensure_future(self._write())
+        try:
+            while not self._stopped.is_set():
+                self.poll()
+                try:
+                    await asyncio.wait_for(self._stopped.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+            await self.drain()
+        finally:
+            writer.cancel()
+
+    def stop(self):
+        """
+        Makes run return after its current scan. Must be called from the event loop thread (or with
+        loop.call_soon_threadsafe).
+        """
+        self._stopped.set()
+
+    def poll(self):
+        """
+        Scans the directory once, and starts reading the files that changed and settled since they were last read.
+        :return: list of strings, paths of the files started
+        """
+        now = time.monotonic()
+        started = []
+        for path_to_file, signature in self._scan():
+            seen = self._seen.get(path_to_file)
+            if seen is None or seen[0] != signature:
+                self._seen[path_to_file] = seen = (signature, now)
+            if (now - seen[1] >= self.settle_seconds and self._ingested.get(path_to_file) != signature and
+                    path_to_file not in self._reading):
+                self._reading.add(path_to_file)
+                task = asyncio.ensure_future(self._read(path_to_file, signature, seen[1]))
+                self._read_tasks.add(task)
+                task.add_done_callback(self._read_tasks.discard)
+                started.append(path_to_file)
+        return started
+
+    async def drain(self):
+        """
+        Waits until the files being read are read and added.
+        """
+        while self._read_tasks:
+            await asyncio.gather(*self._read_tasks)
+        await self._queue.join()
+
+    def _scan(self):
+        """
+        :return: list of tuples (path, (size, modification time)) of the non empty files matching the pattern
+        """
+        files = []
+        with os.scandir(self.path_to_directory) as entries:
+            for entry in entries:
+                if not fnmatch.fnmatch(entry.name, self.pattern) or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                if stat.st_size > 0:
+                    files.append((entry.path, (stat.st_size, stat.st_mtime_ns)))
+        return files
+
+    async def _read(self, path_to_file, signature, changed_at):
+        """
+        Reads a file in the executor and queues it for the writer.
+        """
+        checkpoint = self.db.source_files.get(path_to_file, {}).get('checkpoint')
+        loop = asyncio.get_running_loop()
+        try:
+            new_df, new_checkpoint = await loop.run_in_executor(
+                self.executor, read_new_messages, path_to_file, checkpoint, self.chunksize)
+        except Exception:
+            logger.exception('Failed to read %s', path_to_file)
+            self.metrics.files_failed += 1
+            # not retried until the file changes again
+            self._ingested[path_to_file] = signature
+            self._reading.discard(path_to_file)
+            return
+
+        await self._queue.put((path_to_file, signature, changed_at, new_df, new_checkpoint))
+        self.metrics.queue_depth = self._queue.qsize()
+        self.metrics.max_queue_depth = max(self.metrics.max_queue_depth, self.metrics.queue_depth)
+
+    async def _write(self):
+        """
+        The writer task - adds read files to the database, one at a time.
+        """
+        while True:
+            path_to_file, signature, changed_at, new_df, new_checkpoint = await self._queue.get()
+            self.metrics.queue_depth = self._queue.qsize()
+            try:
+                row_count = len(self.db.df)
+                self.db.add_read_messages(path_to_file, new_df, new_checkpoint)
+                self.metrics.rows_read += len(new_df)
+                self.metrics.rows_added += len(self.db.df) - row_count
+                self.metrics.files_ingested += 1
+                self.metrics.last_latency = time.monotonic() - changed_at
+                self.metrics.total_latency += self.metrics.last_latency
+            except Exception:
+                logger.exception('Failed to add %s', path_to_file)
+                self.metrics.files_failed += 1
+            finally:
+                self._ingested[path_to_file] = signature
+                self._reading.discard(path_to_file)
+                self._queue.task_done()
+
+
+def watch_directory(db, path_to_directory, **kwargs):
+    """
+    Adds exports dropped into a directory to db, until interrupted. See DirectoryIngest.
+    :param db: MessageDatabase
+    :param path_to_directory: string
+    :param kwargs: passed to DirectoryIngest
+    """
+    asyncio.run(DirectoryIngest(db, path_to_directory, **kwargs).run())
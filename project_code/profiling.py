@@ -0,0 +1,222 @@
+import logging
+import os
+import threading
+import time
+import tracemalloc
+
+from contextlib import contextmanager
+
+import pandas as pd
+
+PROFILE_ENV_VAR = 'MESSAGE_DATABASE_PROFILE'  # if set (to anything but '' or '0'), stages are logged as they end
+STAGE_SEPARATOR = '/'  # joins the names of nested stages in StageStats.path
+
+logger = logging.getLogger(__name__)
+
+_active_profiler = None  # Profiler recording stages, None when profiling is off
+
+
+class StageStats(object):
+    """
+    Measurements of one run of a stage. rows is set by the code running the stage, where it is meaningful.
+    """
+
+    def __init__(self, path, depth):
+        """
+        :param path: string, names of the enclosing stages and of this stage, joined by STAGE_SEPARATOR
+        :param depth: int, number of enclosing stages
+        """
+        self.path = path
+        self.depth = depth
+        self.seconds = None
+        self.rows = None
+        self.peak_memory = None  # bytes allocated at the peak of the stage, over what was allocated at its start
+
+    def __repr__(self):
+        return 'StageStats({}, seconds={}, rows={}, peak_memory={})'.format(
+            self.path, self.seconds, self.rows, self.peak_memory)
+
+
+class _NullStage(object):
+    """
+    Stage used while profiling is off - entering and leaving it does nothing, and rows set on it are dropped.
+    """
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage(object):
+    """
+    A running stage of an active Profiler - a context manager that measures what runs inside it.
+    """
+
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+        self._stats = None
+        self._stack = None
+        self._trace_memory = False
+        self._start_memory = None
+        self._peak_memory = None
+        self._start = None
+
+    def __enter__(self):
+        profiler = self._profiler
+        self._stack = stack = profiler._thread_stack()
+        parent = stack[-1] if stack else None
+        path = self._name if parent is None else parent._stats.path + STAGE_SEPARATOR + self._name
+        self._stats = StageStats(path, len(stack))
+        stack.append(self)
+
+        # tracemalloc has a single peak for the whole process - only the thread that started profiling resets it
+        self._trace_memory = profiler.trace_memory and threading.get_ident() == profiler._memory_thread
+        if self._trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if parent is not None:
+                parent._peak_memory = max(parent._peak_memory, peak)
+            # the peak is reset for each stage - enclosing stages keep theirs in _peak_memory
+            tracemalloc.reset_peak()
+            self._start_memory = self._peak_memory = current
+
+        self._start = time.perf_counter()
+        return self._stats
+
+    def __exit__(self, *exc_info):
+        self._stats.seconds = time.perf_counter() - self._start
+        profiler = self._profiler
+        stack = self._stack
+        stack.pop()
+
+        if self._trace_memory:
+            self._peak_memory = max(self._peak_memory, tracemalloc.get_traced_memory()[1])
+            self._stats.peak_memory = self._peak_memory - self._start_memory
+            tracemalloc.reset_peak()
+            if stack:
+                parent = stack[-1]
+                parent._peak_memory = max(parent._peak_memory, self._peak_memory)
+
+        if profiler.keep_stats:
+            profiler.stats.append(self._stats)
+        if profiler.log:
+            logger.info('%s: %.4f s, rows=%s, peak_memory=%s', self._stats.path, self._stats.seconds,
+                        self._stats.rows, self._stats.peak_memory)
+        return False
+
+
+class Profiler(object):
+    """
+    Collects StageStats of the stages run while it is active, in the order they end (inner stages before the stages
+    enclosing them). Each thread nests its stages in its own stack, so stages run in other threads (e.g. queries of
+    ShardedMessageDatabase) are not nested in the stages of the thread that started them. Peak memory is measured
+    only for stages of the thread that created the profiler - in other threads it is left None.
+    """
+
+    def __init__(self, trace_memory=True, log=False, keep_stats=True):
+        """
+        :param trace_memory: bool, whether to measure peak memory of stages with tracemalloc - slows them down. Only
+            stages run in the creating thread are measured
+        :param log: bool, whether to log each stage when it ends
+        :param keep_stats: bool, whether to keep the StageStats in self.stats - without it stages are only logged
+        """
+        self.trace_memory = trace_memory
+        self.log = log
+        self.keep_stats = keep_stats
+        self.stats = []
+        self._local = threading.local()  # stack of running stages of each thread, innermost last
+        self._memory_thread = threading.get_ident()  # the thread whose stages peak memory is measured for
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def _thread_stack(self):
+        """
+        :return: list, the running stages of the current thread, innermost last
+        """
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def to_frame(self):
+        """
+        :return: DataFrame with a row per run of a stage - columns 'stage', 'depth', 'seconds', 'rows', 'peak_memory'
+        """
+        return pd.DataFrame(data={
+            'stage': [stats.path for stats in self.stats],
+            'depth': [stats.depth for stats in self.stats],
+            'seconds': [stats.seconds for stats in self.stats],
+            'rows': pd.array([stats.rows for stats in self.stats], dtype='Int64'),
+            'peak_memory': pd.array([stats.peak_memory for stats in self.stats], dtype='Int64'),
+        })
+
+    def summary(self):
+        """
+        :return: DataFrame indexed by stage - number of runs and total seconds and rows, and the largest peak memory
+        """
+        return self.to_frame().groupby('stage', sort=False).agg(
+            runs=('seconds', 'size'), seconds=('seconds', 'sum'), rows=('rows', lambda rows: rows.sum(min_count=1)),
+            peak_memory=('peak_memory', 'max'))
+
+
+def stage(name):
+    """
+    Measures the code run inside it as a stage of the active profiler:
+        with stage('parse') as stats:
+            df = ...
+            stats.rows = len(df)
+    Does nothing when no profiler is active.
+    :param name: string
+    :return: context manager, entering it gives the StageStats of the stage
+    """
+    if _active_profiler is None:
+        return _NULL_STAGE
+    return _active_profiler.stage(name)
+
+
+@contextmanager
+def profile(trace_memory=True, log=False):
+    """
+    Activates a new Profiler for the code run inside it:
+        with profile() as profiler:
+            db.add_from_file(path_to_file)
+        print(profiler.summary())
+    :param trace_memory: bool, see Profiler
+    :param log: bool, see Profiler
+    :return: context manager, entering it gives the Profiler
+    """
+    global _active_profiler
+    profiler = Profiler(trace_memory=trace_memory, log=log)
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    previous_profiler = _active_profiler
+    _active_profiler = profiler
+    try:
+        yield profiler
+    finally:
+        _active_profiler = previous_profiler
+        if started_tracing:
+            tracemalloc.stop()
+
+
+def active_profiler():
+    """
+    :return: the active Profiler, or None when profiling is off
+    """
+    return _active_profiler
+
+
+if os.environ.get(PROFILE_ENV_VAR, '') not in ('', '0'):
+    # stages of the whole process are logged, not kept - memory is not traced, as tracing slows everything down
+    _active_profiler = Profiler(trace_memory=False, log=True, keep_stats=False)
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+from project_code.text_index import normalize, tokenize_many
+
+
+def load_lexicon(path_to_lexicon, encoding='utf-8'):
+    """
+    Reads a sentiment lexicon from a csv file with 'word' and 'weight' columns.
+    :param path_to_lexicon: string
+    :param encoding: string, encoding of the file
+    :return: dict, word -> weight (positive for positive sentiment)
+    """
+    lexicon = pd.read_csv(path_to_lexicon, encoding=encoding)
+    return dict(zip(lexicon['word'], lexicon['weight']))
+
+
+class SentimentScorer(object):
+    """
+    Scores message contents against a lexicon - the score of a message is the sum of the weights of its tokens.
+    Contents are tokenized in one pass and scored as a sparse (message x token) count matrix times the lexicon
+    weight vector. Scores are cached per distinct content, as chats repeat the same short messages a lot.
+    """
+
+    def __init__(self, lexicon):
+        """
+        :param lexicon: dict, word -> weight. Words are normalized like message tokens (see text_index.normalize).
+        """
+        weights = pd.Series(lexicon, dtype=float)
+        weights.index = [normalize(word) for word in weights.index]
+        # the same normalized word may appear more than once (e.g. with and without points) - keep the first
+        weights = weights[~weights.index.duplicated()]
+        self._tokens = pd.Index(weights.index)
+        self._weights = weights.values
+        self._scores = {}  # content -> score
+
+    def score(self, contents):
+        """
+        :param contents: Series of strings
+        :return: Series of float scores, aligned with contents
+        """
+        codes, unique_contents = pd.factorize(contents)
+        unique_contents = unique_contents.tolist()
+
+        new_contents = [content for content in unique_contents if content not in self._scores]
+        if new_contents:
+            self._scores.update(zip(new_contents, self._score_distinct(new_contents).tolist()))
+
+        unique_scores = np.array([self._scores[content] for content in unique_contents], dtype=float)
+        # missing contents (code -1) get NaN
+        scores = np.full(len(codes), np.nan)
+        has_content = codes >= 0
+        scores[has_content] = unique_scores[codes[has_content]]
+        return pd.Series(scores, index=contents.index)
+
+    def _score_distinct(self, contents):
+        """
+        :param contents: list of distinct strings
+        :return: numpy array of float scores
+        """
+        # one tokenization pass, as (message, token) pairs - the nonzero entries of the count matrix
+        positions, tokens = tokenize_many(contents)
+
+        token_ids = self._tokens.get_indexer(tokens) if tokens else np.array([], dtype=np.int64)
+        in_lexicon = token_ids >= 0
+
+        # count matrix times weight vector - sum the weight of each token occurrence into its message
+        return np.bincount(positions[in_lexicon], weights=self._weights[token_ids[in_lexicon]],
+                           minlength=len(contents))
@@ -0,0 +1,278 @@
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, unquote
+
+import pandas as pd
+
+from project_code.data_prep import ROLLUP_COLUMNS, SENDER_COL, MessageDatabase
+
+CHAT_ID_COL = 'chat_id'  # level of the chat id in results that keep per chat rows
+SHARD_SUFFIX = '.feather'  # appended to the quoted chat id for the file of each shard, see MessageDatabase.save
+
+
+def shard_file_name(chat_id):
+    """
+    :param chat_id: string
+    :return: string, name of the file of the shard of chat_id - the chat id quoted so it is a valid file name
+    """
+    return quote(chat_id, safe='') + SHARD_SUFFIX
+
+
+def chat_id_of_file(path_to_file):
+    """
+    :param path_to_file: string, path to an export
+    :return: string, the default chat id of the export - its file name without extension, e.g. 'WhatsApp Chat with
+        cheches friends' for 'WhatsApp Chat with cheches friends.txt'
+    """
+    return os.path.splitext(os.path.basename(path_to_file))[0]
+
+
+class ShardedMessageDatabase(object):
+    """
+    Several chats, one MessageDatabase (shard) per chat id - each time-sorted and deduplicated on its own, so
+    messages of different chats are never merged together.
+    Adding messages to a chat changes only its shard (and, when stored in a directory, only the file of that shard).
+    Queries over several chats run on a snapshot of each shard in a thread pool, and the partial result of each
+    shard is combined - e.g. top_senders adds up per chat message counts.
+        db = ShardedMessageDatabase()
+        db.add_from_file('family.txt')  # chat id 'family'
+        db.add_from_file('export.txt', chat_id='work')
+        db.top_senders(5, start=datetime(2018, 1, 1))
+    """
+
+    def __init__(self, path_to_directory=None, workers=None):
+        """
+        :param path_to_directory: string or None, if given each shard is saved to its own file in that directory
+            whenever it changes (see shard_file_name). Requires pyarrow.
+        :param workers: int, number of threads queries run in - defaults to the number of CPUs
+        """
+        self.shards = {}  # chat id -> MessageDatabase
+        self.path_to_directory = path_to_directory
+        self.workers = workers
+        self._shards_lock = threading.Lock()  # held while a shard is created, not while it changes
+
+    @classmethod
+    def load(cls, path_to_directory, workers=None):
+        """
+        Loads the shards saved in a directory, in parallel. Changes are saved back to the same directory.
+        :param path_to_directory: string, directory of a ShardedMessageDatabase created with it
+        :param workers: int, see __init__
+        :return: ShardedMessageDatabase
+        """
+        db = cls(path_to_directory, workers=workers)
+        file_names = sorted(name for name in os.listdir(path_to_directory) if name.endswith(SHARD_SUFFIX))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            shards = executor.map(MessageDatabase.load,
+                                  [os.path.join(path_to_directory, name) for name in file_names])
+            for name, shard in zip(file_names, shards):
+                db.shards[unquote(name[:-len(SHARD_SUFFIX)])] = shard
+        return db
+
+    def chat_ids(self):
+        """
+        :return: list of strings, the chat ids, sorted
+        """
+        return sorted(self.shards)
+
+    def shard(self, chat_id):
+        """
+        :param chat_id: string
+        :return: MessageDatabase of the chat
+        """
+        try:
+            return self.shards[chat_id]
+        except KeyError:
+            raise Exception('Unknown chat - {}'.format(chat_id))
+
+    def add_from_file(self, path_to_file, chat_id=None, chunksize=None):
+        """
+        Adds messages of an export to the shard of its chat, creating the shard if it is a new chat. Only that shard
+        is changed - see MessageDatabase.add_from_file.
+        :param path_to_file: string, path to file in correct format
+        :param chat_id: string, defaults to the file name without extension (see chat_id_of_file)
+        :param chunksize: int, see MessageDatabase.add_from_file
+        :return: string, the chat id
+        """
+        if chat_id is None:
+            chat_id = chat_id_of_file(path_to_file)
+        with self._shards_lock:
+            shard = self.shards.get(chat_id)
+            if shard is None:
+                shard = self.shards[chat_id] = MessageDatabase()
+        shard.add_from_file(path_to_file, chunksize=chunksize)
+        self._store(chat_id)
+        return chat_id
+
+    def map_senders(self, mapping_dictionary, chat_ids=None):
+        """
+        Maps senders in the shards of chat_ids, see MessageDatabase.map_senders.
+        :param mapping_dictionary: dict, keys are strings to be replaced with values (strings)
+        :param chat_ids: list of strings, defaults to all chats
+        """
+        for chat_id in self._chat_ids(chat_ids):
+            self.shards[chat_id].map_senders(mapping_dictionary)
+            self._store(chat_id)
+
+    def build_text_index(self, chat_ids=None):
+        """
+        Builds the text index of each shard that has none yet, in parallel. Otherwise search builds the index of the
+        snapshot it runs on, which is lost at the next change of the shard.
+        :param chat_ids: list of strings, defaults to all chats
+        """
+        def build(chat_id):
+            shard = self.shards[chat_id]
+            if shard.text_index is None:
+                shard.build_text_index()
+                self._store(chat_id)
+
+        self._map(build, self._chat_ids(chat_ids))
+
+    def between(self, start=None, end=None, senders=None, chat_ids=None):
+        """
+        Messages sent between start and end (inclusive) in each chat, see MessageDatabase.between.
+        :param start: datetime, defaults to the first message
+        :param end: datetime, defaults to the last message
+        :param senders: list of strings, senders to include, defaults to all
+        :param chat_ids: list of strings, defaults to all chats
+        :return: DataFrame indexed by (chat id, index in the chat)
+        """
+        return _concat_chats(self._fan_out(lambda shard: shard.between(start, end, senders), chat_ids),
+                             MessageDatabase().df)
+
+    def search(self, terms, operator='and', chat_ids=None):
+        """
+        Messages containing the terms in each chat, see MessageDatabase.search.
+        :param terms: list of strings
+        :param operator: string, 'and' or 'or'
+        :param chat_ids: list of strings, defaults to all chats
+        :return: DataFrame indexed by (chat id, index in the chat)
+        """
+        return _concat_chats(self._fan_out(lambda shard: shard.search(terms, operator=operator), chat_ids),
+                             MessageDatabase().df)
+
+    def message_counts(self, start=None, end=None, chat_ids=None):
+        """
+        :param start: datetime, defaults to the first message
+        :param end: datetime, defaults to the last message
+        :param chat_ids: list of strings, defaults to all chats
+        :return: Series, number of messages sent between start and end (inclusive) in each chat, by chat id
+        """
+        counts = self._fan_out(lambda shard: len(shard.between(start, end)), chat_ids)
+        return pd.Series(counts, index=pd.Index(list(counts), name=CHAT_ID_COL), dtype='int64', name='messages')
+
+    def top_senders(self, n=10, start=None, end=None, chat_ids=None):
+        """
+        Senders of the most messages over all chats - a sender with the same name in several chats is counted once,
+        with its messages in all of them.
+        :param n: int, number of senders to return
+        :param start: datetime, defaults to the first message
+        :param end: datetime, defaults to the last message
+        :param chat_ids: list of strings, defaults to all chats
+        :return: Series of message counts by sender, most first (ties by sender name)
+        """
+        def count(shard):
+            return shard.between(start, end).groupby(SENDER_COL, observed=True).size()
+
+        counts = _add_partials(self._fan_out(count, chat_ids), pd.Series(dtype='int64'))
+        counts = counts.sort_index().sort_values(ascending=False, kind='stable')
+        return counts.head(n).rename('messages')
+
+    def activity(self, granularity='day', start=None, end=None, senders=None, chat_ids=None, by_chat=False):
+        """
+        Number of messages, words and special punctuation marks per sender per time period, over all chats. Each
+        shard answers from its own rollups, built in the shard (not in the snapshot the query runs on) so they are
+        updated as messages are added, see MessageDatabase.activity and MessageDatabase.build_rollup.
+        :param granularity: string, 'hour', 'day' or 'month'
+        :param start: datetime, first time period to include (the period containing start), defaults to the first
+        :param end: datetime, last time period to include (the period containing end), defaults to the last
+        :param senders: list of strings, senders to include, defaults to all
+        :param chat_ids: list of strings, defaults to all chats
+        :param by_chat: bool, if True the rows of each chat are kept apart, under a chat id level
+        :return: DataFrame indexed by (period start, sender) - or (chat id, period start, sender) with by_chat -
+            with columns of ROLLUP_COLUMNS
+        """
+        chat_ids = self._chat_ids(chat_ids)
+        self._map(lambda chat_id: self.shards[chat_id].build_rollup(granularity), chat_ids)
+        partials = self._fan_out(lambda shard: shard.activity(granularity, start, end, senders), chat_ids)
+        empty = pd.DataFrame(columns=ROLLUP_COLUMNS, dtype='int64')
+        if by_chat:
+            return _concat_chats(partials, empty)
+        return _add_partials(partials, empty)
+
+    def memory_usage(self):
+        """
+        :return: Series, bytes used by each shard, by chat id
+        """
+        return pd.Series({chat_id: self.shards[chat_id].memory_usage() for chat_id in self.chat_ids()},
+                         dtype='int64', name='bytes')
+
+    def _chat_ids(self, chat_ids):
+        """
+        :param chat_ids: list of strings or None
+        :return: list of strings, chat_ids checked to exist, or all the chat ids
+        """
+        if chat_ids is None:
+            return self.chat_ids()
+        for chat_id in chat_ids:
+            self.shard(chat_id)
+        return list(chat_ids)
+
+    def _map(self, function, chat_ids):
+        """
+        :param function: callable, gets a chat id
+        :param chat_ids: list of strings
+        :return: list, results of function for each chat id, computed in parallel
+        """
+        if len(chat_ids) <= 1:
+            return [function(chat_id) for chat_id in chat_ids]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(function, chat_ids))
+
+    def _fan_out(self, query, chat_ids=None):
+        """
+        Runs a query on a snapshot of each shard, in parallel. The snapshots are all taken before the query runs, so
+        changes to the shards while it runs are not seen.
+        :param query: callable, gets a MessageSnapshot and returns a partial result
+        :param chat_ids: list of strings, defaults to all chats
+        :return: dict, chat id -> partial result, in the order of chat_ids
+        """
+        chat_ids = self._chat_ids(chat_ids)
+        snapshots = {chat_id: self.shards[chat_id].snapshot() for chat_id in chat_ids}
+        results = self._map(lambda chat_id: query(snapshots[chat_id]), chat_ids)
+        return dict(zip(chat_ids, results))
+
+    def _store(self, chat_id):
+        """
+        Saves the shard of chat_id to its file, if the database is stored in a directory.
+        :param chat_id: string
+        """
+        if self.path_to_directory is not None:
+            self.shards[chat_id].snapshot().save(os.path.join(self.path_to_directory, shard_file_name(chat_id)))
+
+
+def _concat_chats(partials, empty):
+    """
+    :param partials: dict, chat id -> DataFrame
+    :param empty: DataFrame, the result without partials
+    :return: DataFrame, the frames one after the other, under a chat id index level
+    """
+    if not partials:
+        return empty
+    return pd.concat(list(partials.values()), keys=list(partials), names=[CHAT_ID_COL])
+
+
+def _add_partials(partials, empty):
+    """
+    :param partials: dict, chat id -> Series or DataFrame of counts
+    :param empty: Series or DataFrame, the result without partials
+    :return: Series or DataFrame, the counts added up by index, sorted by index
+    """
+    partials = [partial for partial in partials.values() if len(partial)]
+    if not partials:
+        return empty
+    combined = pd.concat(partials)
+    # senders are categoricals with different categories in each shard - they are grouped by name
+    levels = list(range(combined.index.nlevels))
+    return combined.groupby(level=levels, sort=True).sum()
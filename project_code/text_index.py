@@ -0,0 +1,180 @@
+import numpy as np
+import pandas as pd
+import re
+
+from itertools import chain
+
+# Hebrew points and cantillation marks - removed, so pointed and unpointed words match.
+# Maqaf (U+05BE), paseq (U+05C0) and sof pasuq (U+05C3) are punctuation and are kept as word separators.
+HEBREW_MARKS_PATTERN = re.compile(u'[\u0591-\u05bd\u05bf\u05c1\u05c2\u05c4\u05c5\u05c7]')
+# geresh and gershayim inside a word (also typed as ' and ") - removed, so abbreviations are a single token
+HEBREW_ABBREVIATION_PATTERN = re.compile(u'(?<=[\u05d0-\u05ea])[\'"\u05f3\u05f4](?=[\u05d0-\u05ea])')
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+TOKENIZE_SEPARATOR = u'\x00'  # joins texts in tokenize_many - not a word character
+
+
+def normalize(text):
+    """
+    Normalizes text for tokenizing - case folded, without Hebrew points and abbreviation marks.
+    :param text: string
+    :return: string
+    """
+    text = HEBREW_MARKS_PATTERN.sub(u'', text.casefold())
+    return HEBREW_ABBREVIATION_PATTERN.sub(u'', text)
+
+
+def tokenize(text):
+    """
+    Splits text into normalized word tokens - runs of Unicode letters, digits and underscores.
+    :param text: string
+    :return: list of strings
+    """
+    return TOKEN_PATTERN.findall(normalize(text))
+
+
+def tokenize_many(contents):
+    """
+    Tokenizes many texts in one pass - the texts are normalized together, as a single string.
+    :param contents: list-like of strings
+    :return: tuple of numpy array of the position in contents of each token, and list of the tokens
+    """
+    contents = list(contents)
+    # normalizing doesn't add or remove the separator, and tokens can't contain it
+    normalized = normalize(TOKENIZE_SEPARATOR.join(contents)).split(TOKENIZE_SEPARATOR) if contents else []
+    token_lists = [TOKEN_PATTERN.findall(text) for text in normalized]
+    lengths = np.fromiter((len(tokens) for tokens in token_lists), dtype=np.int64, count=len(token_lists))
+    return np.repeat(np.arange(len(token_lists)), lengths), list(chain.from_iterable(token_lists))
+
+
+def _postings(contents, rows):
+    """
+    Builds postings for messages in one vectorized pass.
+    :param contents: Series of strings, message contents
+    :param rows: numpy array, row id of each message
+    :return: dict, token -> sorted numpy array of the row ids of messages containing it
+    """
+    positions, tokens = tokenize_many(contents)
+    if not tokens:
+        return {}
+    # a message is listed once per token, however many times the token appears in it
+    pairs = pd.DataFrame(data={'token': tokens, 'row': rows[positions]}).drop_duplicates()
+    return {
+        token: np.sort(pairs['row'].values[positions])
+        for token, positions in pairs.groupby('token', sort=False).indices.items()
+    }
+
+
+class TextIndex(object):
+    """
+    Inverted index over message contents - token -> sorted row ids (positions in the indexed DataFrame) of the
+    messages containing it.
+    """
+
+    def __init__(self, contents=None):
+        """
+        :param contents: Series of strings, message contents to index - row ids are their positions
+        """
+        self.postings = {}
+        self.size = 0  # number of messages indexed
+        if contents is not None:
+            self.extend(contents)
+
+    def extend(self, contents, order=None):
+        """
+        Indexes new messages. Without order the new messages are appended after the indexed ones, otherwise they were
+        merged with them and the row ids of the indexed messages are moved to their merged positions.
+        :param contents: Series of strings, contents of the new messages
+        :param order: numpy array or None, order[i] is the position in the concatenation of indexed and new messages
+            of the i-th merged message, as returned by MessageDatabase._merge_order
+        """
+        if order is None:
+            new_rows = np.arange(self.size, self.size + len(contents))
+        else:
+            merged_position = np.empty(len(order), dtype=np.int64)
+            merged_position[order] = np.arange(len(order))
+            # indexed messages keep their relative order, so their postings stay sorted
+            for token, rows in self.postings.items():
+                self.postings[token] = merged_position[rows]
+            new_rows = merged_position[self.size:]
+
+        for token, rows in _postings(contents, new_rows).items():
+            curr_rows = self.postings.get(token)
+            if curr_rows is None:
+                self.postings[token] = rows
+            elif order is None:
+                self.postings[token] = np.concatenate([curr_rows, rows])
+            else:
+                self.postings[token] = np.sort(np.concatenate([curr_rows, rows]), kind='mergesort')
+        self.size += len(contents)
+
+    def copy(self):
+        """
+        :return: TextIndex with the same postings - extending either does not change the other, as extend replaces
+            postings arrays instead of changing them
+        """
+        index = TextIndex()
+        index.postings = dict(self.postings)
+        index.size = self.size
+        return index
+
+    def search(self, terms, operator='and'):
+        """
+        Finds messages containing all (operator 'and') or any (operator 'or') of the terms.
+        :param terms: list of strings - a term with several words counts as all of them
+        :param operator: string, 'and' or 'or'
+        :return: sorted numpy array of row ids
+        """
+        tokens = [token for term in terms for token in tokenize(term)]
+        postings = [self.postings.get(token, np.array([], dtype=np.int64)) for token in tokens]
+        if not postings:
+            return np.array([], dtype=np.int64)
+
+        if operator == 'and':
+            # intersect starting from the rarest token, so the intermediate results stay small
+            postings.sort(key=len)
+            rows = postings[0]
+            for token_rows in postings[1:]:
+                rows = np.intersect1d(rows, token_rows, assume_unique=True)
+            return rows
+        if operator == 'or':
+            return np.unique(np.concatenate(postings))
+        raise Exception('Unknown operator - {}'.format(operator))
+
+    def search_phrase(self, phrase, contents):
+        """
+        Finds messages containing the words of phrase consecutively. Candidates are found in the index, and only
+        they are checked.
+        :param phrase: string
+        :param contents: Series of strings, contents of the indexed messages, by row id
+        :return: sorted numpy array of row ids
+        """
+        phrase_tokens = tokenize(phrase)
+        candidates = self.search([phrase], operator='and')
+        length = len(phrase_tokens)
+
+        def contains_phrase(content):
+            tokens = tokenize(content)
+            return any(tokens[i:i + length] == phrase_tokens for i in range(len(tokens) - length + 1))
+
+        matches = [contains_phrase(content) for content in contents.iloc[candidates]]
+        return candidates[np.array(matches, dtype=bool)]
+
+    def to_frame(self):
+        """
+        :return: DataFrame with a row per token - columns 'token' and 'rows' (numpy array of row ids)
+        """
+        return pd.DataFrame(data={'token': list(self.postings), 'rows': list(self.postings.values())})
+
+    @classmethod
+    def from_frame(cls, frame, size):
+        """
+        :param frame: DataFrame, as returned by to_frame
+        :param size: int, number of messages indexed
+        :return: TextIndex
+        """
+        index = cls()
+        index.postings = {
+            token: np.asarray(rows, dtype=np.int64) for token, rows in zip(frame['token'], frame['rows'])
+        }
+        index.size = size
+        return index
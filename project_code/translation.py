@@ -0,0 +1,184 @@
+import asyncio
+import sqlite3
+
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_TARGET_LANGUAGE = 'en'
+DEFAULT_BATCH_SIZE = 50  # texts per backend request
+DEFAULT_CONCURRENCY = 4  # backend requests in flight at the same time
+
+
+class TranslationBackend(object):
+    """
+    Interface of a translation service. translate is called from worker threads, several batches at a time.
+    """
+
+    def translate(self, texts, target_language):
+        """
+        :param texts: list of strings
+        :param target_language: string, language code, e.g. 'en'
+        :return: list of strings, translation of each text
+        """
+        raise NotImplementedError
+
+
+class GoogleTransBackend(TranslationBackend):
+    """
+    Translates with the googletrans package (imported on first use).
+    """
+
+    def __init__(self):
+        self._translator = None
+
+    def translate(self, texts, target_language):
+        if self._translator is None:
+            from googletrans import Translator
+            self._translator = Translator()
+        return [result.text for result in self._translator.translate(texts, dest=target_language)]
+
+
+class TranslationCache(object):
+    """
+    Persistent cache of translations, keyed by (text, target language), in an sqlite file.
+    """
+
+    def __init__(self, path_to_cache):
+        """
+        :param path_to_cache: string, path of the sqlite file - created if it does not exist, ':memory:' for a cache
+            that is not persisted
+        """
+        self._connection = sqlite3.connect(path_to_cache)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS translations '
+            '(text TEXT, target_language TEXT, translation TEXT, PRIMARY KEY (text, target_language))'
+        )
+
+    def get(self, texts, target_language):
+        """
+        :param texts: list of strings
+        :param target_language: string
+        :return: dict, text -> translation, for the texts that are in the cache
+        """
+        translations = {}
+        # sqlite limits the number of parameters in a query
+        for start in range(0, len(texts), 500):
+            chunk = texts[start:start + 500]
+            rows = self._connection.execute(
+                'SELECT text, translation FROM translations WHERE target_language = ? AND text IN ({})'.format(
+                    ', '.join('?' * len(chunk))),
+                [target_language] + chunk,
+            )
+            translations.update(rows)
+        return translations
+
+    def put(self, translations, target_language):
+        """
+        :param translations: dict, text -> translation
+        :param target_language: string
+        """
+        with self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO translations VALUES (?, ?, ?)',
+                [(text, target_language, translation) for text, translation in translations.items()],
+            )
+
+    def close(self):
+        self._connection.close()
+
+
+async def _translate_batches(texts, backend, target_language, batch_size, concurrency):
+    """
+    Translates texts in batches, at most concurrency batches at a time, each in a worker thread.
+    :return: dict, text -> translation
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+
+    async def translate_batch(batch):
+        async with semaphore:
+            return await loop.run_in_executor(None, backend.translate, batch, target_language)
+
+    batches = [texts[start:start + batch_size] for start in range(0, len(texts), batch_size)]
+    results = await asyncio.gather(*[translate_batch(batch) for batch in batches])
+
+    translations = {}
+    for batch, batch_translations in zip(batches, results):
+        translations.update(zip(batch, batch_translations))
+    return translations
+
+
+def translate_series(contents, backend, target_language=DEFAULT_TARGET_LANGUAGE, cache=None,
+                     batch_size=DEFAULT_BATCH_SIZE, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Translates message contents. Each distinct text is translated once - texts already in the cache are not sent,
+    the others are sent to the backend in batches, several batches at a time, and added to the cache.
+    Runs its own event loop - in another thread if this thread already runs one (e.g. in Jupyter). Coroutines should
+    await translate_series_async instead, which does not block their loop.
+    :param contents: Series of strings
+    :param backend: TranslationBackend
+    :param target_language: string, language code
+    :param cache: TranslationCache, optional
+    :param batch_size: int, texts per backend request
+    :param concurrency: int, backend requests in flight at the same time
+    :return: Series of translations, aligned with contents - empty texts stay empty
+    """
+    translations, missing_texts = _cached_translations(contents, target_language, cache)
+    if missing_texts:
+        new_translations = _run(
+            _translate_batches(missing_texts, backend, target_language, batch_size, concurrency))
+        _add_translations(translations, new_translations, target_language, cache)
+    return _map_translations(contents, translations)
+
+
+async def translate_series_async(contents, backend, target_language=DEFAULT_TARGET_LANGUAGE, cache=None,
+                                 batch_size=DEFAULT_BATCH_SIZE, concurrency=DEFAULT_CONCURRENCY):
+    """
+    translate_series, as a coroutine of the running event loop.
+    :return: Series of translations, aligned with contents - empty texts stay empty
+    """
+    translations, missing_texts = _cached_translations(contents, target_language, cache)
+    if missing_texts:
+        new_translations = await _translate_batches(missing_texts, backend, target_language, batch_size, concurrency)
+        _add_translations(translations, new_translations, target_language, cache)
+    return _map_translations(contents, translations)
+
+
+def _run(coroutine):
+    """
+    Runs a coroutine to completion in a new event loop - in a worker thread if this thread already runs a loop, as
+    asyncio.run cannot be called from a running loop.
+    :return: the result of the coroutine
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+def _cached_translations(contents, target_language, cache):
+    """
+    :return: tuple of dict, text -> translation, of the distinct texts of contents that are in the cache, and list
+        of the distinct non empty texts that are not
+    """
+    texts = [text for text in contents.dropna().unique() if text != '']
+    translations = {} if cache is None else cache.get(texts, target_language)
+    return translations, [text for text in texts if text not in translations]
+
+
+def _add_translations(translations, new_translations, target_language, cache):
+    """
+    Adds new translations to translations, and to the cache.
+    """
+    if cache is not None:
+        cache.put(new_translations, target_language)
+    translations.update(new_translations)
+
+
+def _map_translations(contents, translations):
+    """
+    :return: Series of the translation of each text of contents
+    """
+    translations[''] = ''
+    return contents.map(translations).rename(None)
@@ -1,3 +1,6 @@
+import os
+import tempfile
+
 from unittest import TestCase
 
 from os import path
@@ -59,6 +62,29 @@ class TestParseMessage(TestCase):
         self.assertEqual(sender, expected_sender)
         self.assertEqual(content, expected_content)
 
+    def test_same_time_as_strptime(self):
+        for msg_time, date_format in [('1/15/18, 11:13', DATE_FORMAT_SLASH), ('12/31/69, 23:59', DATE_FORMAT_SLASH),
+                                      ('2/29/68, 00:00', DATE_FORMAT_SLASH), ('05.01.2018, 09:05', DATE_FORMAT_DOT),
+                                      ('5.1.1999, 10:00', DATE_FORMAT_DOT)]:
+            time, _, _ = parse_message(msg_time + ' - Bob: hi')
+            self.assertEqual(time, datetime.strptime(msg_time, date_format))
+
+    def test_unexpected_date(self):
+        for msg in ['2/30/18, 11:13 - Bob: hi', '1/15/2018, 11:13 - Bob: hi', '15.1.18, 11:13 - Bob: hi',
+                    '1/15/18, 24:00 - Bob: hi']:
+            with self.assertRaises(ValueError):
+                parse_message(msg)
+
+    def test_date_format(self):
+        self.assertEqual(sniff_date_format('19.5.2016, 20:42 - Bob: hi\nmore'), DATE_FORMAT_DOT)
+        self.assertEqual(sniff_date_format('1/15/18, 11:13 - Bob: hi'), DATE_FORMAT_SLASH)
+        with self.assertRaises(Exception):
+            sniff_date_format('blah blah')
+
+        # a time in the other format is still parsed by its own format
+        time, _, _ = parse_message('1/15/18, 11:13 - Bob: hi', DATE_FORMAT_DOT)
+        self.assertEqual(time, datetime(2018, 1, 15, 11, 13))
+
 
 class TestReadFile(TestCase):
     def test_sanity(self):
@@ -91,3 +117,211 @@ class TestReadFile(TestCase):
             data={'message_time': expected_time, 'message_sender': expected_sender, 'message_content': expected_content},
         )
         assert_frame_equal(actual_df, expected_df)
+
+
+def write_temp_file(text):
+    """
+    Writes text to a temporary file in utf-8 and returns its path - caller is responsible for removing it.
+    """
+    handle, path_to_file = tempfile.mkstemp(suffix='.txt')
+    with os.fdopen(handle, 'wb') as f:
+        f.write(text.encode('utf-8'))
+    return path_to_file
+
+
+SAMPLE_EXPORT = (
+    u'6/16/17, 14:01 - bob: hello\n'
+    u'6/16/17, 14:02 - alice is the best: hi  \r\n'
+    u'6/16/17, 14:03 - charles, you know who he is: first message row\n'
+    u'second message row\n'
+    u'\n'
+    u'charles is done speaking...\n'
+    u'16.6.2017, 14:04 - ‪+972 50-686-1962‬‬: hello: again\n'
+    u'not a header 6/16/17, 14:05 - bob: hi'
+)
+
+
+class TestParseText(TestCase):
+    def test_same_as_read_file_per_line(self):
+        path_to_file = write_temp_file(SAMPLE_EXPORT)
+        try:
+            assert_frame_equal(read_file(path_to_file), read_file_per_line(path_to_file))
+        finally:
+            os.remove(path_to_file)
+
+    def test_continuation_lines(self):
+        actual_df = parse_text(SAMPLE_EXPORT)
+
+        self.assertEqual(len(actual_df), 8)
+        self.assertListEqual(list(actual_df[SENDER_COL].iloc[2:6]), ['charles, you know who he is'] * 4)
+        self.assertListEqual(list(actual_df[CONTENT_COL].iloc[2:6]),
+                             ['first message row', 'second message row', '', 'charles is done speaking...'])
+        self.assertEqual(actual_df[CONTENT_COL].iloc[-1], 'not a header 6/16/17, 14:05 - bob: hi')
+
+    def test_both_date_formats(self):
+        actual_df = parse_text(SAMPLE_EXPORT)
+        self.assertEqual(actual_df[TIME_COL].iloc[0], datetime(2017, 6, 16, 14, 1))
+        self.assertEqual(actual_df[TIME_COL].iloc[6], datetime(2017, 6, 16, 14, 4))
+
+    def test_first_line_not_header(self):
+        with self.assertRaises(Exception):
+            parse_text('blah blah')
+
+
+class TestReadFileChunked(TestCase):
+    def setUp(self):
+        self.path_to_file = write_temp_file(SAMPLE_EXPORT)
+
+    def tearDown(self):
+        os.remove(self.path_to_file)
+
+    def test_same_as_read_file(self):
+        expected_df = read_file(self.path_to_file)
+        for chunksize in [1, 2, 3, 100]:
+            actual_df = pd.concat(read_file_chunked(self.path_to_file, chunksize=chunksize))
+            assert_frame_equal(actual_df, expected_df)
+
+    def test_chunk_sizes(self):
+        chunk_lengths = [len(chunk) for chunk in read_file_chunked(self.path_to_file, chunksize=3)]
+        self.assertListEqual(chunk_lengths, [3, 3, 2])
+
+    def test_continuation_across_chunks(self):
+        # chunk boundary falls between 'first message row' and its continuation lines
+        chunks = list(read_file_chunked(self.path_to_file, chunksize=3))
+        self.assertEqual(chunks[1][SENDER_COL].iloc[0], 'charles, you know who he is')
+        self.assertEqual(chunks[1][TIME_COL].iloc[0], datetime(2017, 6, 16, 14, 3))
+        self.assertEqual(chunks[1][CONTENT_COL].iloc[0], 'second message row')
+
+    def test_iter_messages(self):
+        messages = list(iter_messages(self.path_to_file, chunksize=2))
+        self.assertEqual(len(messages), 8)
+        self.assertEqual(messages[0], (datetime(2017, 6, 16, 14, 1), 'bob', 'hello'))
+
+
+class TestCheckpoint(TestCase):
+    def setUp(self):
+        self.path_to_file = write_temp_file(SAMPLE_EXPORT + u'\n')
+
+    def tearDown(self):
+        os.remove(self.path_to_file)
+
+    def test_file_checkpoint(self):
+        checkpoint = file_checkpoint(self.path_to_file)
+        size = os.path.getsize(self.path_to_file)
+        last_message = u'16.6.2017, 14:04 - ‪+972 50-686-1962‬‬: hello: again\nnot a header 6/16/17, 14:05 - bob: hi\n'
+        self.assertEqual(checkpoint['end_offset'], size)
+        self.assertEqual(checkpoint['message_offset'], size - len(last_message.encode('utf-8')))
+
+    def test_read_file_from_checkpoint(self):
+        checkpoint = file_checkpoint(self.path_to_file)
+        with open(self.path_to_file, 'ab') as f:
+            f.write(u'continued\n6/17/17, 09:00 - bob: good morning\n'.encode('utf-8'))
+
+        tail_df = read_file_from_checkpoint(self.path_to_file, checkpoint)
+
+        self.assertListEqual(list(tail_df[CONTENT_COL]),
+                             ['again', 'not a header 6/16/17, 14:05 - bob: hi', 'continued', 'good morning'])
+        self.assertEqual(tail_df[TIME_COL].iloc[2], datetime(2017, 6, 16, 14, 4))
+        assert_frame_equal(read_file_from_checkpoint(self.path_to_file, checkpoint, chunksize=2), tail_df)
+
+    def test_read_file_from_checkpoint_partial_line(self):
+        checkpoint = file_checkpoint(self.path_to_file)
+        with open(self.path_to_file, 'ab') as f:
+            f.write(u'6/17/17, 09:00 - bob: good morning\n6/17/17, 09:01 - bob: still wri'.encode('utf-8'))
+
+        # the last line may still be written - it is not read until it ends with a newline
+        for chunksize in [None, 1]:
+            tail_df = read_file_from_checkpoint(self.path_to_file, checkpoint, chunksize=chunksize)
+            self.assertEqual(tail_df[CONTENT_COL].iloc[-1], 'good morning')
+
+    def test_read_file_from_checkpoint_changed_file(self):
+        checkpoint = file_checkpoint(self.path_to_file)
+        with open(self.path_to_file, 'wb') as f:
+            f.write(SAMPLE_EXPORT.replace('hello: again', 'hello: agane').encode('utf-8'))
+
+        self.assertIsNone(read_file_from_checkpoint(self.path_to_file, checkpoint))
+
+
+class TestReadFileParallel(TestCase):
+    def setUp(self):
+        self.path_to_file = write_temp_file(SAMPLE_EXPORT)
+
+    def tearDown(self):
+        os.remove(self.path_to_file)
+
+    def test_same_as_read_file(self):
+        expected_df = read_file(self.path_to_file)
+        for workers in [2, 3, 8]:
+            assert_frame_equal(read_file(self.path_to_file, workers=workers), expected_df)
+
+    def test_split_offsets_at_headers(self):
+        from project_code.data_prep import _split_offsets
+
+        offsets = _split_offsets(self.path_to_file, 8)
+        with open(self.path_to_file, 'rb') as f:
+            data = f.read()
+
+        self.assertEqual(offsets[0], 0)
+        self.assertEqual(offsets[-1], len(data))
+        for offset in offsets[1:-1]:
+            self.assertIsNotNone(TIME_SENDER_PATTERN.match(str(data[offset:], 'utf-8')))
+
+
+class TestByteOrderMark(TestCase):
+    def setUp(self):
+        self.path_to_file = write_temp_file(u'\ufeff' + SAMPLE_EXPORT)
+        self.path_without_bom = write_temp_file(SAMPLE_EXPORT)
+
+    def tearDown(self):
+        os.remove(self.path_to_file)
+        os.remove(self.path_without_bom)
+
+    def test_readers(self):
+        expected_df = read_file(self.path_without_bom)
+        self.assertEqual(expected_df[TIME_COL].iloc[0], datetime(2017, 6, 16, 14, 1))
+        assert_frame_equal(read_file(self.path_to_file), expected_df)
+        assert_frame_equal(read_file(self.path_to_file, workers=3), expected_df)
+        assert_frame_equal(pd.concat(read_file_chunked(self.path_to_file, chunksize=2)), expected_df)
+        assert_frame_equal(read_file_per_line(self.path_to_file), read_file_per_line(self.path_without_bom))
+
+    def test_checkpoint_of_first_message(self):
+        pth = write_temp_file(u'\ufeff6/16/17, 14:01 - bob: hello\n')
+        try:
+            checkpoint = file_checkpoint(pth)
+            self.assertEqual(checkpoint['message_offset'], 0)
+            self.assertListEqual(list(read_file_from_checkpoint(pth, checkpoint)[CONTENT_COL]), ['hello'])
+        finally:
+            os.remove(pth)
+
+    def test_empty_file(self):
+        pth = write_temp_file(u'')
+        try:
+            self.assertEqual(len(read_file(pth)), 0)
+        finally:
+            os.remove(pth)
+
+
+class TestGeneratedExport(TestCase):
+    def test_read_file(self):
+        from benchmarks.generate_export import DATE_FORMATS, expected_rows, generate_messages, write_export
+
+        messages = generate_messages(500, multiline_ratio=0.3)
+        for date_format in DATE_FORMATS:
+            handle, pth = tempfile.mkstemp(suffix='.txt')
+            os.close(handle)
+            try:
+                write_export(pth, messages, date_format)
+                df = read_file(pth)
+                assert_frame_equal(df, read_file_per_line(pth), check_dtype=False)
+            finally:
+                os.remove(pth)
+            assert_frame_equal(df, expected_rows(messages), check_dtype=False)
+
+    def test_overlapping_messages(self):
+        from benchmarks.generate_export import overlapping_messages
+
+        first, second = overlapping_messages(100, 30)
+        self.assertEqual(len(first), 100)
+        self.assertEqual(len(second), 100)
+        assert_frame_equal(first.iloc[70:].reset_index(drop=True), second.iloc[:30])
+        self.assertLessEqual(first[TIME_COL].iloc[-1], second[TIME_COL].iloc[30])
@@ -0,0 +1,90 @@
+import asyncio
+import os
+import shutil
+import tempfile
+
+from unittest import TestCase
+
+from project_code.data_prep import MessageDatabase
+from project_code.ingest import DirectoryIngest
+from test_data_prep import SAMPLE_EXPORT
+
+
+class TestDirectoryIngest(TestCase):
+    def setUp(self):
+        self.path_to_directory = tempfile.mkdtemp()
+        self.path_to_file = os.path.join(self.path_to_directory, 'chat.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.path_to_directory)
+
+    def write(self, text, mode='wb'):
+        with open(self.path_to_file, mode) as f:
+            f.write(text.encode('utf-8'))
+
+    def test_new_and_grown_files(self):
+        db = MessageDatabase()
+        ingest = DirectoryIngest(db, self.path_to_directory, settle_seconds=0)
+
+        async def scenario():
+            ingest._queue = asyncio.Queue()
+            writer = asyncio.ensure_future(ingest._write())
+
+            self.write(SAMPLE_EXPORT)
+            with open(os.path.join(self.path_to_directory, 'notes.md'), 'wb') as f:
+                f.write(b'not an export')
+            self.assertListEqual(ingest.poll(), [self.path_to_file])
+            await ingest.drain()
+            self.assertListEqual(ingest.poll(), [])  # unchanged since it was read
+
+            self.write(u'\n6/17/17, 09:00 - bob: next day\n', mode='ab')
+            self.assertListEqual(ingest.poll(), [self.path_to_file])
+            await ingest.drain()
+            writer.cancel()
+
+        asyncio.run(scenario())
+
+        expected_db = MessageDatabase(self.path_to_file)
+        self.assertListEqual(list(db.df['message_content']), list(expected_db.df['message_content']))
+        self.assertEqual(ingest.metrics.files_ingested, 2)
+        self.assertEqual(ingest.metrics.rows_added, len(expected_db.df))
+        self.assertEqual(ingest.metrics.queue_depth, 0)
+        self.assertIsNotNone(ingest.metrics.as_dict()['mean_latency'])
+
+    def test_settle(self):
+        self.write(SAMPLE_EXPORT)
+        ingest = DirectoryIngest(MessageDatabase(), self.path_to_directory, settle_seconds=60)
+
+        async def scenario():
+            return ingest.poll()
+
+        self.assertListEqual(asyncio.run(scenario()), [])
+
+    def test_run_and_stop(self):
+        self.write(SAMPLE_EXPORT)
+        db = MessageDatabase()
+        ingest = DirectoryIngest(db, self.path_to_directory, poll_interval=0.01, settle_seconds=0)
+
+        async def scenario():
+            run = asyncio.ensure_future(ingest.run())
+            while ingest.metrics.files_ingested == 0:
+                await asyncio.sleep(0.01)
+            ingest.stop()
+            await run
+
+        asyncio.run(scenario())
+        self.assertEqual(len(db.df), len(MessageDatabase(self.path_to_file).df))
+
+    def test_bad_file(self):
+        self.write(u'not a message header\n')
+        ingest = DirectoryIngest(MessageDatabase(), self.path_to_directory, settle_seconds=0)
+
+        async def scenario():
+            ingest._queue = asyncio.Queue()
+            ingest.poll()
+            await ingest.drain()
+            return ingest.poll()
+
+        with self.assertLogs('project_code.ingest'):
+            self.assertListEqual(asyncio.run(scenario()), [])
+        self.assertEqual(ingest.metrics.files_failed, 1)
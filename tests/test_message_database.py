@@ -1,15 +1,44 @@
-from unittest import TestCase
+import os
 
-from datetime import datetime
+from unittest import TestCase, skipIf
+
+from datetime import datetime, timedelta
 from os import path
 from pandas.testing import assert_frame_equal, assert_series_equal
 
 import pandas as pd
 
-from project_code.data_prep import MessageDatabase, PATH_TO_DATA
+from project_code import data_prep
+from project_code.data_prep import MessageDatabase, PATH_TO_DATA, load_stopwords
+from test_data_prep import SAMPLE_EXPORT, write_temp_file
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
 
 
 class TestMessageDatabase(TestCase):
+    def temp_file(self, text):
+        """
+        Writes text to a temporary file that is removed when the test ends, and returns its path.
+        """
+        pth = write_temp_file(text)
+        self.addCleanup(os.remove, pth)
+        return pth
+
+    def database(self, *texts, **kwargs):
+        """
+        Creates a database from temporary files of the texts - from the first one, then adding the others in order.
+        :param kwargs: passed to MessageDatabase
+        :return: MessageDatabase
+        """
+        pths = [self.temp_file(text) for text in texts]
+        db = MessageDatabase(pths[0], **kwargs)
+        for pth in pths[1:]:
+            db.add_from_file(pth)
+        return db
+
     def test_init(self):
         pth = path.join(PATH_TO_DATA, 'WhatsApp Chat with cheches friends 1.txt')
 
@@ -66,183 +95,12 @@ class TestMessageDatabase(TestCase):
             'hello again',
         ]
         expected_df = pd.DataFrame(
-            data={'message_time': expected_time, 'message_sender': expected_sender, 'message_content': expected_content},
+            data={'message_time': expected_time, 'message_sender': pd.Categorical(expected_sender),
+                  'message_content': expected_content},
         )
         assert_frame_equal(new_db.df, expected_df)
         self.assertDictEqual(new_db.mapping_dictionary, change_names)
 
-    def test_return_new_not_in_current_overlap_1(self):
-        # Test [ ( ] ) - overlap between start of left and end of right
-        data_left = {
-            'message_content': ['a', 'b', 'c', 'd', 'e'],
-            'message_sender': ['a', 'b', 'c', 'd', 'e'],
-            'message_time': [
-                datetime(2000, 1, 1, 10, 0),
-                datetime(2000, 1, 1, 10, 5),
-                datetime(2000, 1, 1, 10, 10),
-                datetime(2000, 1, 1, 10, 15),
-                datetime(2000, 1, 1, 10, 20),
-            ]
-        }
-        data_right = {
-            'message_content': ['a', 'b', 'c', 'd', 'e'],
-            'message_sender': ['a', 'b', 'c', 'd', 'e'],
-            'message_time': [
-                datetime(2000, 1, 1, 9, 0),  # too early
-                datetime(2000, 1, 1, 9, 30),  # too early
-                datetime(2000, 1, 1, 10, 5),  # same time, different sender
-                datetime(2000, 1, 1, 10, 15),  # same time, same sender and content
-                datetime(2000, 1, 1, 10, 18),  # same sender, different time
-            ]
-        }
-
-        expected = pd.DataFrame({
-            'message_content': ['c', 'e'],
-            'message_sender': ['c', 'e'],
-            'message_time': [
-                datetime(2000, 1, 1, 10, 5),  # same time, different sender
-                datetime(2000, 1, 1, 10, 18),
-            ]
-        }, index=[2, 4])
-
-        left = pd.DataFrame(data_left)
-        right = pd.DataFrame(data_right)
-        start = datetime(2000, 1, 1, 10, 5)
-        end = datetime(2000, 1, 1, 10, 18)
-        actual = MessageDatabase._return_new_not_in_current_overlap(left, right, start, end)
-        assert_frame_equal(actual, expected)
-
-    def test_return_new_not_in_current_overlap_2(self):
-        # Test [ ( ) ] - overlap between start of left and end of left
-        data_left = {
-            'message_content': ['a', 'b', 'c', 'd', 'e'],
-            'message_sender': ['a', 'b', 'c', 'd', 'e'],
-            'message_time': [
-                datetime(2000, 1, 1, 10, 0),
-                datetime(2000, 1, 1, 10, 5),
-                datetime(2000, 1, 1, 10, 10),
-                datetime(2000, 1, 1, 10, 15),
-                datetime(2000, 1, 1, 10, 20),
-            ]
-        }
-        data_right = {
-            'message_content': ['a', 'b', 'c', 'd', 'e', 'f'],
-            'message_sender': ['a', 'b', 'c', 'd', 'e', 'f'],
-            'message_time': [
-                datetime(2000, 1, 1, 9, 0),  # too early
-                datetime(2000, 1, 1, 9, 30),  # too early
-                datetime(2000, 1, 1, 10, 5),  # same time, different sender
-                datetime(2000, 1, 1, 10, 15),  # same time, same sender and content
-                datetime(2000, 1, 1, 10, 18),  # same sender, different time
-                datetime(2000, 1, 1, 10, 50),  # too late
-            ]
-        }
-
-        expected = pd.DataFrame({
-            'message_content': ['c', 'e'],
-            'message_sender': ['c', 'e'],
-            'message_time': [
-                datetime(2000, 1, 1, 10, 5),  # same time, different sender
-                datetime(2000, 1, 1, 10, 18),
-            ]
-        }, index=[2, 4])
-
-        left = pd.DataFrame(data_left)
-        right = pd.DataFrame(data_right)
-        start = datetime(2000, 1, 1, 10, 5)
-        end = datetime(2000, 1, 1, 10, 18)
-        actual = MessageDatabase._return_new_not_in_current_overlap(left, right, start, end)
-        assert_frame_equal(actual, expected)
-
-    def test_return_new_not_in_current_overlap_3(self):
-        # Test ( [ ) ] - overlap between start of right and end of left
-        data_left = {
-            'message_content': ['z', 'x', 'a', 'b', 'c', 'd', 'e'],
-            'message_sender': ['z', 'x', 'a', 'b', 'c', 'd', 'e'],
-            'message_time': [
-                datetime(2000, 1, 1, 8, 5),
-                datetime(2000, 1, 1, 8, 30),
-                datetime(2000, 1, 1, 10, 0),
-                datetime(2000, 1, 1, 10, 5),
-                datetime(2000, 1, 1, 10, 10),
-                datetime(2000, 1, 1, 10, 15),
-                datetime(2000, 1, 1, 10, 20),
-            ]
-        }
-        data_right = {
-            'message_content': ['a', 'b', 'c', 'd', 'e', 'f'],
-            'message_sender': ['a', 'b', 'c', 'd', 'e', 'f'],
-            'message_time': [
-                datetime(2000, 1, 1, 9, 0),  # too early
-                datetime(2000, 1, 1, 9, 30),  # too early
-                datetime(2000, 1, 1, 10, 5),  # same time, different sender
-                datetime(2000, 1, 1, 10, 15),  # same time, same sender and content
-                datetime(2000, 1, 1, 10, 18),  # same sender, different time
-                datetime(2000, 1, 1, 10, 50),  # too late
-            ]
-        }
-
-        expected = pd.DataFrame({
-            'message_content': ['c', 'e'],
-            'message_sender': ['c', 'e'],
-            'message_time': [
-                datetime(2000, 1, 1, 10, 5),  # same time, different sender
-                datetime(2000, 1, 1, 10, 18),
-            ]
-        }, index=[2, 4])
-
-        left = pd.DataFrame(data_left)
-        right = pd.DataFrame(data_right)
-        start = datetime(2000, 1, 1, 10, 5)
-        end = datetime(2000, 1, 1, 10, 18)
-        actual = MessageDatabase._return_new_not_in_current_overlap(left, right, start, end)
-        assert_frame_equal(actual, expected)
-
-    def test_return_new_not_in_current_overlap_4(self):
-        # Test ( [ ] ) - overlap between start of right and end of right
-        data_left = {
-            'message_content': ['z', 'x', 'a', 'b', 'c', 'd', 'e', 'f', 'g'],
-            'message_sender': ['z', 'x', 'a', 'b', 'c', 'd', 'e', 'f', 'g'],
-            'message_time': [
-                datetime(2000, 1, 1, 8, 5),
-                datetime(2000, 1, 1, 8, 30),
-                datetime(2000, 1, 1, 10, 0),
-                datetime(2000, 1, 1, 10, 5),
-                datetime(2000, 1, 1, 10, 10),
-                datetime(2000, 1, 1, 10, 15),
-                datetime(2000, 1, 1, 10, 20),
-                datetime(2000, 1, 1, 13, 20),
-                datetime(2000, 1, 1, 13, 22),
-            ]
-        }
-        data_right = {
-            'message_content': ['a', 'b', 'c', 'd', 'e'],
-            'message_sender': ['a', 'b', 'c', 'd', 'e'],
-            'message_time': [
-                datetime(2000, 1, 1, 9, 0),  # too early
-                datetime(2000, 1, 1, 9, 30),  # too early
-                datetime(2000, 1, 1, 10, 5),  # same time, different sender
-                datetime(2000, 1, 1, 10, 15),  # same time, same sender and content
-                datetime(2000, 1, 1, 10, 18),  # same sender, different time
-            ]
-        }
-
-        expected = pd.DataFrame({
-            'message_content': ['c', 'e'],
-            'message_sender': ['c', 'e'],
-            'message_time': [
-                datetime(2000, 1, 1, 10, 5),  # same time, different sender
-                datetime(2000, 1, 1, 10, 18),
-            ]
-        }, index=[2, 4])
-
-        left = pd.DataFrame(data_left)
-        right = pd.DataFrame(data_right)
-        start = datetime(2000, 1, 1, 10, 5)
-        end = datetime(2000, 1, 1, 10, 18)
-        actual = MessageDatabase._return_new_not_in_current_overlap(left, right, start, end)
-        assert_frame_equal(actual, expected)
-
     def test_add_from_file(self):
         pth1 = path.join(PATH_TO_DATA, 'tests', '1.txt')
         pth2 = path.join(PATH_TO_DATA, 'tests', '2.txt')
@@ -287,7 +145,7 @@ class TestMessageDatabase(TestCase):
             'great!'
         ]
         expected_df = pd.DataFrame(
-            data={'message_time': expected_time, 'message_sender': expected_sender,
+            data={'message_time': expected_time, 'message_sender': pd.Categorical(expected_sender),
                   'message_content': expected_content},
         )
         assert_frame_equal(db.df, expected_df)
@@ -299,6 +157,18 @@ class TestMessageDatabase(TestCase):
         expected = pd.Series([1, 1, 3, 3, 4, 1, 2])
         assert_series_equal(word_count, expected)
 
+    def test_count_words_without_stopwords(self):
+        stopwords_pth = self.temp_file(u'Undotted,POS\nעל,preposition\nאת,preposition\nבית,noun\n')
+        self.addCleanup(setattr, data_prep, '_stopwords', None)
+        self.assertSetEqual(load_stopwords(stopwords_pth, encoding='utf-8'), {u'על', u'את'})
+
+        db = self.database(u'1/1/18, 09:00 - a: על הבית את\n1/1/18, 10:00 - b: את\n1/1/18, 11:00 - a: בית על בית\n')
+        assert_series_equal(db._count_words(remove_stopwords=True), pd.Series([1, 0, 2]))
+        assert_series_equal(db._count_words(), pd.Series([3, 1, 3]))
+
+        db.add_information(['word_count_without_stopwords'])
+        self.assertListEqual(list(db.df['word_count_without_stopwords']), [1, 0, 2])
+
     def test_count_special_punctuation(self):
         pth = path.join(PATH_TO_DATA, 'tests', '2.txt')
         db = MessageDatabase(pth)
@@ -314,8 +184,439 @@ class TestMessageDatabase(TestCase):
         assert_series_equal(time_bin, expected)
 
     def test_time_diff(self):
-        pth = path.join(PATH_TO_DATA, 'tests', '2.txt')
-        db = MessageDatabase(pth)
+        db = self.database(u'6/16/17, 14:01 - bob: a\n6/16/17, 14:02 - bob: b\n6/16/17, 15:05 - bob: c\n'
+                           u'6/16/17, 15:07 - bob: d\n6/16/17, 15:11 - bob: e\n')
         time_diff = db._time_diff()
-        expected = pd.Series([pd.nan, 1, 63, 2, 4])
+        expected = pd.Series([float('nan'), 1, 63, 2, 4], dtype=float)
         assert_series_equal(time_diff, expected)
+
+    def test_init_chunked(self):
+        pth = self.temp_file(SAMPLE_EXPORT)
+        assert_frame_equal(MessageDatabase(pth, chunksize=2).df, MessageDatabase(pth).df)
+
+    def test_add_from_file_any_overlap(self):
+        # new file covers the current time range on both sides and is not monotonic
+        new_text = (u'1/1/18, 10:05 - b: y\n1/1/18, 09:00 - c: early\n'
+                    u'1/1/18, 10:05 - c: y\n1/1/18, 10:00 - a: x\n1/1/18, 11:00 - a: late\n')
+        # adding the same file again adds nothing
+        db = self.database(u'1/1/18, 10:00 - a: x\n1/1/18, 10:05 - b: y\n', new_text, new_text)
+
+        self.assertEqual(len(db.df), 5)
+        self.assertListEqual(sorted(db.df['message_content']), ['early', 'late', 'x', 'y', 'y'])
+        self.assertListEqual(sorted(db.df['message_sender'][db.df['message_content'] == 'y']), ['b', 'c'])
+
+    def test_init_unsorted_export(self):
+        text = u'1/1/18, 10:00 - a: late\n1/1/18, 09:00 - b: early\ncontinued\n1/1/18, 09:30 - a: middle\n'
+        db = self.database(text)
+        self.assertListEqual(list(db.df['message_content']), ['early', 'continued', 'middle', 'late'])
+        self.assertTrue(db.df.index.equals(pd.RangeIndex(4)))
+        messages = db.between(datetime(2018, 1, 1, 9, 0), datetime(2018, 1, 1, 9, 45))
+        self.assertListEqual(list(messages['message_content']), ['early', 'continued', 'middle'])
+
+        added_db = MessageDatabase()
+        added_db.add_from_file(self.temp_file(text))
+        assert_frame_equal(added_db.df, db.df)
+
+    def test_add_empty_export(self):
+        db = self.database(SAMPLE_EXPORT)
+        dtypes = db.df.dtypes.astype(str)
+        snapshot = db.snapshot()
+
+        db._add_messages([db.df.astype({'message_sender': str})])  # all duplicates
+        self.assertIs(db.snapshot(), snapshot)
+        db.add_from_file(self.temp_file(u''))
+        assert_series_equal(db.df.dtypes.astype(str), dtypes)
+        self.assertListEqual(list(db.feature('time_bin')[:2]), ['14:00', '14:00'])
+
+        for chunksize in [None, 2]:
+            empty_db = self.database(u'', chunksize=chunksize)
+            self.assertEqual(len(empty_db.df), 0)
+            assert_series_equal(empty_db.df.dtypes.astype(str), dtypes)
+
+    def test_merge_order(self):
+        curr = pd.DataFrame({
+            'message_time': [datetime(2000, 1, 1, 10, 0), datetime(2000, 1, 1, 10, 5), datetime(2000, 1, 1, 10, 10)],
+            'message_sender': ['a', 'b', 'c'],
+            'message_content': ['a', 'b', 'c'],
+        })
+        new = pd.DataFrame({
+            'message_time': [datetime(2000, 1, 1, 10, 7), datetime(2000, 1, 1, 9, 0), datetime(2000, 1, 1, 10, 5)],
+            'message_sender': ['d', 'e', 'f'],
+            'message_content': ['d', 'e', 'f'],
+        }, index=[7, 3, 5])
+
+        new = MessageDatabase._sort_by_time(new)
+        order = MessageDatabase._merge_order(curr['message_time'], new['message_time'])
+        actual = MessageDatabase._take_merged(curr, new, order)
+
+        self.assertListEqual(list(actual['message_sender']), ['e', 'a', 'b', 'f', 'd', 'c'])
+        self.assertTrue(actual.index.equals(pd.RangeIndex(6)))
+
+    def test_merge_order_append(self):
+        curr = pd.DataFrame({
+            'message_time': [datetime(2000, 1, 1, 10, 0), datetime(2000, 1, 1, 10, 5)],
+            'message_sender': ['a', 'b'],
+            'message_content': ['a', 'b'],
+        })
+        new = pd.DataFrame({
+            'message_time': [datetime(2000, 1, 1, 10, 5), datetime(2000, 1, 1, 11, 0)],
+            'message_sender': ['c', 'd'],
+            'message_content': ['c', 'd'],
+        }, index=[4, 5])
+
+        order = MessageDatabase._merge_order(curr['message_time'], new['message_time'])
+        self.assertIsNone(order)
+        actual = MessageDatabase._take_merged(curr, new, order)
+
+        self.assertListEqual(list(actual['message_sender']), ['a', 'b', 'c', 'd'])
+        self.assertTrue(actual.index.equals(pd.RangeIndex(4)))
+
+    @skipIf(pyarrow is None, 'save and load require pyarrow')
+    def test_save_load(self):
+        db = self.database(SAMPLE_EXPORT)
+        db.map_senders({'bob': 'robert'})
+        store_pth = self.temp_file(u'')
+        db.save(store_pth)
+        loaded_db = MessageDatabase.load(store_pth)
+
+        assert_frame_equal(loaded_db.df, db.df)
+        self.assertDictEqual(loaded_db.mapping_dictionary, {'bob': 'robert'})
+        self.assertDictEqual(loaded_db.source_files, db.source_files)
+        self.assertSetEqual(loaded_db._message_hashes, db._message_hashes)
+        # mapped senders do not hide messages that are read again
+        loaded_db.add_from_file(self.temp_file(SAMPLE_EXPORT))
+        self.assertEqual(len(loaded_db.df), len(db.df))
+
+    def test_add_from_file_grown_export(self):
+        pth = self.temp_file(SAMPLE_EXPORT + u'\n')
+        db = MessageDatabase(pth)
+        with open(pth, 'ab') as f:
+            f.write(u'6/17/17, 09:00 - bob: good morning\n'.encode('utf-8'))
+        db.add_from_file(pth)
+
+        assert_frame_equal(db.df, MessageDatabase(pth).df)
+        # only the last message of the first export and the new message were read the second time
+        self.assertEqual(db.source_files[pth]['messages'], 3)
+
+    def test_add_from_file_partial_line(self):
+        pth = self.temp_file(SAMPLE_EXPORT + u'\n')
+        db = MessageDatabase(pth)
+        with open(pth, 'ab') as f:
+            f.write(u'6/17/17, 09:00 - bob: good mor'.encode('utf-8'))
+        db.add_from_file(pth)
+        self.assertEqual(len(db.df), 8)
+
+        with open(pth, 'ab') as f:
+            f.write(u'ning\n'.encode('utf-8'))
+        db.add_from_file(pth)
+        assert_frame_equal(db.df, MessageDatabase(pth).df)
+
+    def test_full_read_partial_line(self):
+        # every first read of a file leaves out a last line without a newline, and reads it once it is complete
+        pth = self.temp_file(SAMPLE_EXPORT + u'\n6/17/17, 09:00 - bob: good mor')
+        added_db = MessageDatabase()
+        added_db.add_from_file(pth)
+        dbs = [MessageDatabase(pth), MessageDatabase(pth, chunksize=2), MessageDatabase.from_files([pth]), added_db]
+        for db in dbs:
+            self.assertEqual(len(db.df), 8)
+
+        with open(pth, 'ab') as f:
+            f.write(u'ning\n'.encode('utf-8'))
+        for db in dbs:
+            db.add_from_file(pth)
+            self.assertListEqual(list(db.df['message_content'][-2:]), [u'not a header 6/16/17, 14:05 - bob: hi', u'good morning'])
+            self.assertEqual(len(db.df), 9)
+
+    def test_from_files(self):
+        pths = [self.temp_file(text) for text in [
+            u'1/1/18, 10:00 - a: x\n1/1/18, 10:05 - b: y\n1/1/18, 10:05 - b: y\n',
+            u'1/1/18, 10:05 - b: y\n1/1/18, 09:00 - c: early\n1/1/18, 10:05 - c: y\n',
+            u'1/1/18, 10:05 - c: y\n1/1/18, 10:05 - d: z\n1/1/18, 11:00 - a: late\n',
+        ]]
+        serial_db = MessageDatabase(pths[0])
+        for pth in pths[1:]:
+            serial_db.add_from_file(pth)
+        parallel_db = MessageDatabase.from_files(pths, workers=2)
+
+        assert_frame_equal(parallel_db.df, serial_db.df)
+        self.assertSetEqual(parallel_db._message_hashes, serial_db._message_hashes)
+        self.assertListEqual(sorted(parallel_db.source_files), sorted(pths))
+
+        empty_db = MessageDatabase.from_files([])
+        assert_frame_equal(empty_db.df, MessageDatabase().df)
+        self.assertDictEqual(empty_db.source_files, {})
+
+    def test_add_information(self):
+        db = self.database(u'1/1/18, 09:00 - a: hi there?!\n1/1/18, 10:05 - b: ok\nwhat?\n1/2/18, 10:05 - a: x y z\n')
+        db.add_information(['word_count', 'punctuation_count', 'time_bin', 'time_diff'])
+
+        self.assertListEqual(list(db.df['word_count']), [2, 1, 1, 3])
+        self.assertListEqual(list(db.df['punctuation_count']), [2, 0, 1, 0])
+        self.assertListEqual(list(db.df['time_bin']), ['9:00', '10:00', '10:00', '10:00'])
+        assert_series_equal(db.df['time_diff'], pd.Series([float('nan'), 65, 0, 24 * 60], name='time_diff'))
+
+    def test_add_information_selected_features(self):
+        db = self.database(u'1/1/18, 09:00 - a: hi there?!\n')
+        db.add_information(['word_count'])
+
+        self.assertListEqual(list(db.df.columns), ['message_time', 'message_sender', 'message_content', 'word_count'])
+        with self.assertRaises(Exception):
+            db.add_information(['no_such_feature'])
+
+    def test_feature_cache(self):
+        db = self.database(u'1/1/18, 09:00 - a: hi there?!\n1/1/18, 10:05 - b: ok\n')
+        db.add_information(['word_count', 'time_diff'])
+        word_count = db.feature('word_count')
+        self.assertIs(db.feature('word_count'), word_count)
+
+        db.add_from_file(self.temp_file(u'1/1/18, 09:30 - c: one two three\n1/1/18, 11:00 - a: ?\n'))
+
+        # cached features and feature columns match a fresh computation over the merged messages
+        assert_series_equal(db.feature('word_count'), db._count_words())
+        assert_series_equal(db.feature('time_diff'), db._time_diff())
+        self.assertListEqual(list(db.df['word_count']), [2, 3, 1, 1])
+        self.assertListEqual(list(db.df['time_diff'][1:]), [30, 35, 55])
+
+    def test_feature_cache_map_senders(self):
+        db = self.database(u'1/1/18, 09:00 - a: hi there?!\n')
+        word_count = db.feature('word_count')
+        db.map_senders({'a': 'alice'})
+        # word count does not depend on senders, so it stays cached
+        self.assertIs(db.feature('word_count'), word_count)
+
+    def test_senders_categorical(self):
+        db = self.database(u'1/1/18, 09:00 - bob: a\n1/1/18, 10:00 - alice: b\n',
+                           u'1/1/18, 09:30 - charles: c\n1/1/18, 10:00 - alice: b\n')
+
+        assert_series_equal(db.df['message_sender'],
+                            pd.Series(pd.Categorical(['bob', 'charles', 'alice']), name='message_sender'))
+
+    def test_map_senders_partial_and_merging(self):
+        db = self.database(u'1/1/18, 09:00 - bob: a\n1/1/18, 10:00 - robert: b\n1/1/18, 11:00 - alice: c\n')
+        db.map_senders({'robert': 'bob'})
+
+        assert_series_equal(db.df['message_sender'],
+                            pd.Series(pd.Categorical(['bob', 'bob', 'alice']), name='message_sender'))
+        self.assertDictEqual(db.mapping_dictionary, {'robert': 'bob'})
+
+    def test_map_senders_relabels_categories(self):
+        text = u'1/1/18, 09:00 - alice: a\n1/1/18, 10:00 - bob: b\n1/1/18, 11:00 - alice: c\n'
+        db = self.database(text)
+        codes = db.df['message_sender'].cat.codes.values
+
+        db.map_senders({'alice': 'zed'})
+        self.assertListEqual(list(db.df['message_sender']), ['zed', 'bob', 'zed'])
+        self.assertListEqual(list(db.df['message_sender'].cat.categories), ['zed', 'bob'])
+        self.assertListEqual(list(db.df['message_sender'].cat.codes.values), list(codes))
+
+        # the messages are still known by the senders they were read with
+        db.add_from_file(self.temp_file(text))
+        self.assertEqual(len(db.df), 3)
+
+        # new senders are appended to the categories
+        db.add_from_file(self.temp_file(u'1/1/18, 10:30 - carol: d\n1/1/18, 10:40 - aaron: e\n'))
+        self.assertListEqual(list(db.df['message_sender'].cat.categories), ['zed', 'bob', 'aaron', 'carol'])
+        self.assertListEqual(list(db.df['message_sender']), ['zed', 'bob', 'carol', 'aaron', 'zed'])
+
+    def test_map_senders_new_messages(self):
+        db = self.database(u'1/1/18, 09:00 - bob: a\n1/1/18, 10:00 - ‪+972 50-686-1962‬: b\n')
+        db.map_senders({'bob': 'robert', '+972 50-686-1962': 'dana'})
+        db.map_senders({'robert': 'rob', 'bob': 'ignored'})
+        self.assertDictEqual(db.mapping_dictionary, {'bob': 'rob', '+972 50-686-1962': 'dana', 'robert': 'rob'})
+
+        # messages added later are mapped like the ones already in the database
+        db.add_from_file(self.temp_file(u'1/2/18, 09:00 - bob: c\n1/2/18, 09:05 - ‪+972 50-686-1962‬: d\n'
+                                        u'1/2/18, 09:10 - carol: e\n'))
+        self.assertListEqual(list(db.df['message_sender']), ['rob', 'dana', 'rob', 'dana', 'carol'])
+        self.assertListEqual(list(db.df['message_sender'].cat.categories), ['rob', 'dana', 'carol'])
+        activity = db.activity('month')
+        self.assertListEqual(list(activity.index.get_level_values('message_sender')), ['carol', 'dana', 'rob'])
+        self.assertListEqual(list(activity['messages']), [1, 2, 2])
+
+    def test_map_senders_direction_marks(self):
+        db = self.database(u'1/1/18, 09:00 - ‪+972 50-686-1962‬: a\n1/1/18, 10:00 - bob: b\n')
+
+        self.assertListEqual(list(db.df['message_sender']), [u'‪+972 50-686-1962‬', 'bob'])
+        db.map_senders({'+972 50-686-1962': 'dana'})
+        self.assertListEqual(list(db.df['message_sender']), ['dana', 'bob'])
+
+    def test_activity(self):
+        db = self.database(u'1/1/18, 09:00 - a: hi there?!\n1/1/18, 09:30 - b: ok\n1/2/18, 10:05 - a: x y z\n')
+        db.activity('day')  # computed before the merge, updated by it
+        db.add_from_file(self.temp_file(u'1/1/18, 09:45 - a: one more\n2/1/18, 10:00 - b: ?\n'))
+
+        day_activity = db.activity('day', start=datetime(2018, 1, 1, 12, 0), end=datetime(2018, 1, 31))
+        expected = pd.DataFrame(
+            data={'messages': [2, 1, 1], 'words': [4, 1, 3], 'punctuation': [2, 0, 0]},
+            index=pd.MultiIndex.from_tuples(
+                [(datetime(2018, 1, 1), 'a'), (datetime(2018, 1, 1), 'b'), (datetime(2018, 1, 2), 'a')],
+                names=['period', 'message_sender']),
+        )
+        assert_frame_equal(day_activity, expected, check_index_type=False)
+
+        month_activity = db.activity('month', senders=['b'])
+        self.assertListEqual(list(month_activity['messages']), [1, 1])
+
+        hour_of_day = db.hour_of_day_activity(senders=['a'])
+        self.assertListEqual(list(hour_of_day.index.get_level_values('hour')), [9, 10])
+        self.assertListEqual(list(hour_of_day['messages']), [2, 1])
+
+    def test_between(self):
+        db = self.database(u'1/1/18, 09:00 - a: 1\n1/1/18, 09:30 - b: 2\n1/1/18, 09:30 - a: 3\n'
+                           u'1/1/18, 10:00 - b: 4\n1/1/18, 11:00 - a: 5\n')
+
+        messages = db.between(datetime(2018, 1, 1, 9, 30), datetime(2018, 1, 1, 10, 0))
+        self.assertListEqual(list(messages['message_content']), ['2', '3', '4'])
+        self.assertListEqual(list(messages.index), [1, 2, 3])
+
+        messages = db.between(start=datetime(2018, 1, 1, 9, 15), senders=['a'])
+        self.assertListEqual(list(messages['message_content']), ['3', '5'])
+
+        self.assertEqual(len(db.between(end=datetime(2018, 1, 1, 8, 0))), 0)
+
+    def test_search(self):
+        db = self.database(u'1/1/18, 09:00 - a: good morning\n1/1/18, 10:00 - b: בוקר טוב\n')
+        self.assertListEqual(list(db.search(['good'])['message_sender']), ['a'])
+        # the index is updated with the merged messages
+        db.add_from_file(self.temp_file(u'1/1/18, 09:30 - c: morning good\n1/1/18, 11:00 - a: good night\n'))
+
+        self.assertListEqual(list(db.search(['good', 'morning'])['message_sender']), ['a', 'c'])
+        self.assertListEqual(list(db.search(['night', 'טוב'], operator='or')['message_sender']), ['b', 'a'])
+        self.assertListEqual(list(db.search_phrase('good morning')['message_sender']), ['a'])
+
+    @skipIf(pyarrow is None, 'save and load require pyarrow')
+    def test_save_load_text_index(self):
+        db = self.database(SAMPLE_EXPORT)
+        db.build_text_index()
+        store_pth = self.temp_file(u'')
+        db.save(store_pth)
+        self.addCleanup(os.remove, store_pth + '.text_index')
+        loaded_db = MessageDatabase.load(store_pth)
+
+        self.assertIsNotNone(loaded_db.text_index)
+        assert_frame_equal(loaded_db.search(['message']), db.search(['message']))
+
+    def test_add_translation(self):
+        from test_translation import FakeBackend
+
+        db = self.database(u'1/1/18, 09:00 - a: תודה!\n1/1/18, 10:00 - b: ok\n1/1/18, 11:00 - a: תודה!\n')
+        db.add_translation(FakeBackend())
+        self.assertListEqual(list(db.df['message_translation']), [u'en:תודה!', u'en:OK', u'en:תודה!'])
+
+    def test_add_sentiment(self):
+        from project_code.sentiment import SentimentScorer
+
+        db = self.database(u'1/1/18, 09:00 - a: תודה!\n1/1/18, 10:00 - b: ok\n')
+        db.add_sentiment(SentimentScorer({u'תודה': 2}))
+        self.assertListEqual(list(db.df['message_sentiment']), [2.0, 0.0])
+
+    def test_sessions(self):
+        db = self.database(u'1/1/18, 09:00 - a: hi\n1/1/18, 09:10 - b: hey\n1/1/18, 09:40 - a: ok\n'
+                           u'1/1/18, 12:00 - b: again\n1/2/18, 08:00 - b: morning\n1/2/18, 08:05 - b: anyone?\n')
+
+        sessions = db.sessions(gap_minutes=60)
+        self.assertListEqual(list(db.session_ids(gap_minutes=60)), [0, 0, 0, 1, 2, 2])
+        self.assertListEqual(list(sessions['messages']), [3, 1, 2])
+        self.assertListEqual(list(sessions['duration_minutes']), [40, 0, 5])
+        self.assertListEqual(list(sessions['participants']), [2, 1, 1])
+        self.assertListEqual(list(sessions['starter']), ['a', 'b', 'b'])
+        self.assertListEqual(list(sessions['responses']), [2, 0, 0])
+        self.assertEqual(sessions['mean_response_minutes'].iloc[0], 20)
+        self.assertEqual(sessions['start'].iloc[1], datetime(2018, 1, 1, 12, 0))
+
+        latencies = db.response_latencies(gap_minutes=60)
+        self.assertListEqual(list(latencies['responses']), [1, 1])
+        self.assertListEqual(list(latencies['mean_minutes']), [30, 10])
+        self.assertListEqual(list(latencies.index), [('a', 'b'), ('b', 'a')])
+
+        db.add_information(['session_id'])
+        self.assertListEqual(list(db.df['session_id']), [0, 0, 0, 1, 2, 2])
+
+    def test_sessions_extended(self):
+        full_db = self.database(SAMPLE_EXPORT)
+
+        messages = full_db.df.astype({'message_sender': str})
+        for gap_minutes in [0, 1, 60]:
+            db = MessageDatabase()
+            db._set_messages(messages.iloc[:3].copy())
+            db.sessions(gap_minutes)
+            db._add_messages([messages.iloc[3:5], messages.iloc[5:]])
+            assert_frame_equal(db.sessions(gap_minutes), full_db.sessions(gap_minutes), check_index_type=False)
+            self.assertListEqual(list(db.session_ids(gap_minutes)), list(full_db.session_ids(gap_minutes)))
+
+            # messages merged before the last one drop the cache
+            db._add_messages([messages.iloc[:1].assign(message_content='earlier')])
+            self.assertDictEqual(db._sessions, {})
+
+    def test_snapshot(self):
+        db = self.database(u'1/1/18, 09:00 - a: hi\n1/1/18, 10:00 - b: ok\n')
+        db.add_information(['word_count'])
+        snapshot = db.snapshot()
+        self.assertIs(db.snapshot(), snapshot)
+        db.add_from_file(self.temp_file(u'1/1/18, 09:30 - c: in between\n1/1/18, 11:00 - a: bye\n'))
+
+        self.assertListEqual(list(snapshot.df['message_content']), ['hi', 'ok'])
+        self.assertListEqual(list(snapshot.df['word_count']), [1, 1])
+        self.assertListEqual(list(db.df['message_content']), ['hi', 'in between', 'ok', 'bye'])
+        self.assertListEqual(list(db.df['word_count']), [1, 2, 1, 1])
+
+        new_snapshot = db.snapshot()
+        self.assertIsNot(new_snapshot, snapshot)
+        self.assertGreater(new_snapshot.version, snapshot.version)
+        assert_frame_equal(new_snapshot.df, db.df)
+
+        db.map_senders({'a': 'alice'})
+        self.assertListEqual(list(new_snapshot.df['message_sender']), ['a', 'c', 'b', 'a'])
+        self.assertListEqual(list(new_snapshot.search(['ok'])['message_sender']), ['b'])
+        self.assertListEqual(list(new_snapshot.activity('day')['messages']), [2, 1, 1])
+        with self.assertRaises(Exception):
+            new_snapshot.add_from_file(self.temp_file(u'1/1/18, 12:00 - a: later\n'))
+        with self.assertRaises(Exception):
+            new_snapshot.map_senders({'b': 'bob'})
+
+    def test_snapshot_concurrent_reads(self):
+        import threading
+
+        start = datetime(2018, 1, 1)
+
+        def export(part):
+            # each file is in time order, and its times fall between the times of the other files
+            lines = []
+            for i in range(200):
+                t = start + timedelta(minutes=20 * i + part)
+                lines.append(u'{}/{}/{}, {:02d}:{:02d} - s{}: message {} {}\n'.format(
+                    t.month, t.day, t.year % 100, t.hour, t.minute, i % 3, part, i))
+            return u''.join(lines)
+
+        pths = [self.temp_file(export(part)) for part in range(20)]
+        db = MessageDatabase(pths[0])
+        db.add_information(['word_count'])
+        db.build_text_index()
+        errors = []
+        done = threading.Event()
+
+        def read():
+            try:
+                while not done.is_set():
+                    snapshot = db.snapshot()
+                    df = snapshot.df
+                    self.assertTrue(df['message_time'].is_monotonic_increasing)
+                    self.assertEqual(len(df) % 200, 0)
+                    self.assertEqual(df['word_count'].notna().sum(), len(df))
+                    self.assertEqual(len(snapshot.search(['message'])), len(df))
+            except Exception as e:
+                errors.append(e)
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        try:
+            for reader in readers:
+                reader.start()
+            for pth in pths[1:]:
+                db.add_from_file(pth)
+        finally:
+            done.set()
+            for reader in readers:
+                reader.join()
+
+        self.assertListEqual(errors, [])
+        self.assertEqual(len(db.snapshot().df), 200 * len(pths))
@@ -0,0 +1,81 @@
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from project_code.data_prep import MessageDatabase, read_file
+from project_code.profiling import active_profiler, profile, stage
+from test_data_prep import SAMPLE_EXPORT, write_temp_file
+
+
+class TestProfile(TestCase):
+    def test_nested_stages(self):
+        with profile() as profiler:
+            with stage('outer') as outer_stats:
+                with stage('inner') as inner_stats:
+                    data = [0] * 100000
+                    inner_stats.rows = len(data)
+                del data
+                outer_stats.rows = 1
+
+        self.assertListEqual([stats.path for stats in profiler.stats], ['outer/inner', 'outer'])
+        self.assertListEqual([stats.depth for stats in profiler.stats], [1, 0])
+        self.assertEqual(profiler.stats[0].rows, 100000)
+        # the list allocated in the inner stage counts in the peak of both
+        self.assertGreaterEqual(profiler.stats[0].peak_memory, 800000)
+        self.assertGreaterEqual(profiler.stats[1].peak_memory, profiler.stats[0].peak_memory)
+        self.assertGreaterEqual(profiler.stats[1].seconds, profiler.stats[0].seconds)
+
+    def test_stages_in_threads(self):
+        barrier = threading.Barrier(2)
+
+        def run(name):
+            with stage(name):
+                with stage('inner'):
+                    barrier.wait()  # both threads are inside their stages at once
+
+        with profile() as profiler:
+            with stage('outer'):
+                with ThreadPoolExecutor(max_workers=2) as executor:
+                    list(executor.map(run, ['first', 'second']))
+
+        stats = {stats.path: stats for stats in profiler.stats}
+        self.assertListEqual(sorted(stats), ['first', 'first/inner', 'outer', 'second', 'second/inner'])
+        self.assertEqual(stats['second/inner'].depth, 1)
+        # memory is measured only in the thread that created the profiler
+        self.assertIsNone(stats['first'].peak_memory)
+        self.assertIsNotNone(stats['outer'].peak_memory)
+
+    def test_disabled(self):
+        self.assertIsNone(active_profiler())
+        with stage('ignored') as stats:
+            stats.rows = 1
+        self.assertIsNone(stats.rows)
+
+        with profile(trace_memory=False) as profiler:
+            self.assertIs(active_profiler(), profiler)
+            with stage('recorded'):
+                pass
+        self.assertIsNone(active_profiler())
+        self.assertIsNone(profiler.stats[0].peak_memory)
+
+    def test_ingest_stages(self):
+        pth = write_temp_file(SAMPLE_EXPORT)
+        try:
+            db = MessageDatabase()
+            with profile() as profiler:
+                df = read_file(pth)
+                db.add_from_file(pth)
+                db.add_from_file(pth)  # read from its checkpoint
+                db.add_information(['word_count'])
+        finally:
+            os.remove(pth)
+
+        summary = profiler.summary()
+        for name in ['read_file/regex', 'read_file/parse_times', 'add_from_file/read_file/decode',
+                     'add_from_file/dedup', 'add_information/feature_word_count']:
+            self.assertIn(name, summary.index)
+        self.assertEqual(summary.loc['read_file', 'rows'], len(df))
+        self.assertEqual(summary.loc['add_from_file', 'runs'], 2)
+        self.assertEqual(summary.loc['add_from_file/read_file_from_checkpoint', 'runs'], 1)
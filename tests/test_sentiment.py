@@ -0,0 +1,40 @@
+import os
+import tempfile
+
+from unittest import TestCase
+
+import pandas as pd
+from pandas.testing import assert_series_equal
+
+from project_code.sentiment import SentimentScorer, load_lexicon
+
+
+class TestSentimentScorer(TestCase):
+    def setUp(self):
+        self.scorer = SentimentScorer({u'good': 1, u'bad': -1.5, u'תודה': 2, u'טוֹב': 1})
+
+    def test_sanity(self):
+        contents = pd.Series([u'good good bad', u'Good!', u'nothing', u''], index=[3, 4, 5, 6])
+        assert_series_equal(self.scorer.score(contents), pd.Series([0.5, 1, 0, 0], index=[3, 4, 5, 6]))
+
+    def test_hebrew(self):
+        # the lexicon word is pointed, the message is not
+        assert_series_equal(self.scorer.score(pd.Series([u'תודה! בוקר טוב'])), pd.Series([3.0]))
+
+    def test_cache(self):
+        self.scorer.score(pd.Series([u'good', u'good', u'bad']))
+        self.assertDictEqual(self.scorer._scores, {u'good': 1, u'bad': -1.5})
+
+        assert_series_equal(self.scorer.score(pd.Series([u'bad', u'good bad'])), pd.Series([-1.5, -0.5]))
+        self.assertEqual(len(self.scorer._scores), 3)
+
+
+class TestLoadLexicon(TestCase):
+    def test_sanity(self):
+        handle, path_to_lexicon = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(handle, 'wb') as f:
+            f.write(u'word,weight\ngood,1\nרע,-1\n'.encode('utf-8'))
+        try:
+            self.assertDictEqual(load_lexicon(path_to_lexicon), {u'good': 1, u'רע': -1})
+        finally:
+            os.remove(path_to_lexicon)
@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+
+from unittest import TestCase, skipIf
+
+from datetime import datetime
+from pandas.testing import assert_frame_equal
+
+import pandas as pd
+
+from project_code.data_prep import MessageDatabase
+from project_code.sharded import ShardedMessageDatabase, chat_id_of_file, shard_file_name
+from test_data_prep import SAMPLE_EXPORT, write_temp_file
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# the first message is also in SAMPLE_EXPORT - a different chat, so it is not a duplicate
+OTHER_EXPORT = u'6/16/17, 14:01 - bob: hello\n6/18/17, 10:00 - dan: other chat\n6/18/17, 10:05 - bob: yes?\n'
+
+
+class TestShardedMessageDatabase(TestCase):
+    def setUp(self):
+        # complete exports end with a newline - a last line without one is not read yet
+        self.paths = [write_temp_file(SAMPLE_EXPORT + u'\n'), write_temp_file(OTHER_EXPORT)]
+        self.db = ShardedMessageDatabase(workers=2)
+        self.db.add_from_file(self.paths[0], chat_id='sample')
+        self.db.add_from_file(self.paths[1], chat_id='other')
+
+    def tearDown(self):
+        for pth in self.paths:
+            os.remove(pth)
+
+    def test_chats_kept_apart(self):
+        self.assertListEqual(self.db.chat_ids(), ['other', 'sample'])
+        for chat_id, pth in zip(['sample', 'other'], self.paths):
+            assert_frame_equal(self.db.shard(chat_id).df, MessageDatabase(pth).df)
+        self.assertDictEqual(self.db.message_counts().to_dict(), {'other': 3, 'sample': 8})
+        self.assertListEqual(list(self.db.search(['hello']).index), [('other', 0), ('sample', 0)])
+        with self.assertRaises(Exception):
+            self.db.shard('missing')
+
+    def test_add_touches_only_its_shard(self):
+        other_snapshot = self.db.shard('other').snapshot()
+        self.db.add_from_file(self.paths[0], chat_id='sample')
+        self.db.add_from_file(self.paths[0])
+        self.assertIs(self.db.shard('other').snapshot(), other_snapshot)
+        self.assertEqual(len(self.db.shard('sample').df), 8)
+        self.assertIn(chat_id_of_file(self.paths[0]), self.db.chat_ids())
+
+    def test_top_senders(self):
+        top_senders = self.db.top_senders(2)
+        self.assertDictEqual(top_senders.to_dict(), {'charles, you know who he is': 4, 'bob': 3})
+
+        top_senders = self.db.top_senders(start=datetime(2017, 6, 17))
+        self.assertDictEqual(top_senders.to_dict(), {'bob': 1, 'dan': 1})
+        self.assertEqual(len(ShardedMessageDatabase().top_senders()), 0)
+
+    def test_activity(self):
+        activity = self.db.activity('day')
+        per_chat = self.db.activity('day', by_chat=True)
+        self.assertListEqual(list(per_chat.index.get_level_values('chat_id').unique()), ['other', 'sample'])
+        # partial counts of each chat add up to the combined counts
+        combined = per_chat.groupby(level=[1, 2]).sum()
+        assert_frame_equal(activity, combined)
+        self.assertEqual(activity.loc[(pd.Timestamp(2017, 6, 16), 'bob'), 'messages'], 2)
+        self.assertEqual(activity['messages'].sum(), 11)
+
+        activity = self.db.activity('day', start=datetime(2017, 6, 18), chat_ids=['other'], senders=['dan'])
+        self.assertListEqual(list(activity['messages']), [1])
+
+    def test_activity_rollups_kept_in_shards(self):
+        self.db.activity('day')
+        shard = self.db.shard('other')
+        self.assertIn('day', shard._rollups)
+        self.assertIs(shard.snapshot()._rollups['day'], shard._rollups['day'])
+
+        # the rollup of the shard is extended with new messages, not computed again by the next query
+        pth = write_temp_file(u'6/19/17, 09:00 - bob: later\n')
+        try:
+            self.db.add_from_file(pth, chat_id='other')
+        finally:
+            os.remove(pth)
+        self.assertIn('day', shard._rollups)
+        activity = self.db.activity('day', chat_ids=['other'])
+        self.assertIs(shard.snapshot()._rollups['day'], shard._rollups['day'])
+        self.assertEqual(activity.loc[(pd.Timestamp(2017, 6, 19), 'bob'), 'messages'], 1)
+        self.assertEqual(activity['messages'].sum(), 4)
+
+    @skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_store(self):
+        path_to_directory = tempfile.mkdtemp()
+        try:
+            db = ShardedMessageDatabase(path_to_directory)
+            db.add_from_file(self.paths[0], chat_id='sample/1')
+            self.assertListEqual(os.listdir(path_to_directory), [shard_file_name('sample/1')])
+
+            modified = os.path.getmtime(os.path.join(path_to_directory, shard_file_name('sample/1')))
+            db.add_from_file(self.paths[1], chat_id='other')
+            self.assertEqual(os.path.getmtime(os.path.join(path_to_directory, shard_file_name('sample/1'))), modified)
+
+            loaded_db = ShardedMessageDatabase.load(path_to_directory)
+            self.assertListEqual(loaded_db.chat_ids(), ['other', 'sample/1'])
+            assert_frame_equal(loaded_db.shard('sample/1').df, db.shard('sample/1').df)
+        finally:
+            shutil.rmtree(path_to_directory)
@@ -0,0 +1,59 @@
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+from project_code.text_index import TextIndex, tokenize
+
+
+class TestTokenize(TestCase):
+    def test_sanity(self):
+        self.assertListEqual(tokenize(u'Hello, World! hello'), [u'hello', u'world', u'hello'])
+
+    def test_hebrew(self):
+        # points are removed, maqaf separates words, gershayim in an abbreviation do not
+        self.assertListEqual(tokenize(u'שָׁלוֹם בית־ספר צה"ל צה״ל'), [u'שלום', u'בית', u'ספר', u'צהל', u'צהל'])
+
+    def test_direction_marks(self):
+        self.assertListEqual(tokenize(u'‪תודה!‬ ok'), [u'תודה', u'ok'])
+
+
+class TestTextIndex(TestCase):
+    def setUp(self):
+        self.contents = pd.Series([u'good morning', u'בוקר טוב', u'good night', u'morning good', u'תודה!'])
+        self.index = TextIndex(self.contents)
+
+    def test_search_and(self):
+        np.testing.assert_array_equal(self.index.search([u'good', u'morning']), [0, 3])
+
+    def test_search_or(self):
+        np.testing.assert_array_equal(self.index.search([u'night', u'טוב'], operator='or'), [1, 2])
+
+    def test_search_missing_term(self):
+        self.assertEqual(len(self.index.search([u'good', u'evening'])), 0)
+
+    def test_search_phrase(self):
+        np.testing.assert_array_equal(self.index.search_phrase(u'Good morning', self.contents), [0])
+
+    def test_extend_append(self):
+        self.index.extend(pd.Series([u'good evening']))
+        np.testing.assert_array_equal(self.index.search([u'good']), [0, 2, 3, 5])
+
+    def test_extend_merged(self):
+        # new message goes between the first and second messages
+        order = np.array([0, 5, 1, 2, 3, 4])
+        self.index.extend(pd.Series([u'good evening']), order)
+        np.testing.assert_array_equal(self.index.search([u'good']), [0, 1, 3, 4])
+        np.testing.assert_array_equal(self.index.search([u'תודה']), [5])
+
+    def test_copy(self):
+        copied_index = self.index.copy()
+        copied_index.extend(pd.Series([u'good evening']), np.array([0, 5, 1, 2, 3, 4]))
+        np.testing.assert_array_equal(self.index.search([u'good']), [0, 2, 3])
+        np.testing.assert_array_equal(copied_index.search([u'good']), [0, 1, 3, 4])
+        self.assertEqual(self.index.size, 5)
+
+    def test_frame_round_trip(self):
+        loaded_index = TextIndex.from_frame(self.index.to_frame(), self.index.size)
+        np.testing.assert_array_equal(loaded_index.search([u'good']), [0, 2, 3])
+        self.assertEqual(loaded_index.size, 5)
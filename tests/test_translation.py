@@ -0,0 +1,99 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+
+from unittest import TestCase
+
+import pandas as pd
+from pandas.testing import assert_series_equal
+
+from project_code.translation import TranslationBackend, TranslationCache, translate_series, translate_series_async
+
+
+class FakeBackend(TranslationBackend):
+    """
+    Offline backend - "translates" by upper-casing, and records the batches it was sent.
+    """
+
+    def __init__(self, delay=0):
+        self.batches = []
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def translate(self, texts, target_language):
+        with self._lock:
+            self.batches.append(list(texts))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self._lock:
+            self.in_flight -= 1
+        return [u'{}:{}'.format(target_language, text.upper()) for text in texts]
+
+
+class TestTranslateSeries(TestCase):
+    def test_sanity(self):
+        contents = pd.Series([u'ok', u'hi', u'ok', u'', u'hi'])
+        backend = FakeBackend()
+
+        actual = translate_series(contents, backend)
+
+        assert_series_equal(actual, pd.Series([u'en:OK', u'en:HI', u'en:OK', u'', u'en:HI']))
+        # each distinct text is sent once
+        self.assertListEqual(sorted(text for batch in backend.batches for text in batch), [u'hi', u'ok'])
+
+    def test_batches_and_concurrency(self):
+        contents = pd.Series([u'text {}'.format(i) for i in range(10)])
+        backend = FakeBackend(delay=0.05)
+
+        translate_series(contents, backend, batch_size=3, concurrency=2)
+
+        self.assertListEqual(sorted(len(batch) for batch in backend.batches), [1, 3, 3, 3])
+        self.assertLessEqual(backend.max_in_flight, 2)
+
+    def test_cache(self):
+        handle, path_to_cache = tempfile.mkstemp(suffix='.sqlite')
+        os.close(handle)
+        try:
+            cache = TranslationCache(path_to_cache)
+            translate_series(pd.Series([u'תודה!', u'ok']), FakeBackend(), cache=cache)
+            cache.close()
+
+            # a new cache on the same file has the translations, so only the new text is sent
+            cache = TranslationCache(path_to_cache)
+            backend = FakeBackend()
+            actual = translate_series(pd.Series([u'ok', u'new', u'תודה!']), backend, cache=cache)
+            cache.close()
+        finally:
+            os.remove(path_to_cache)
+
+        assert_series_equal(actual, pd.Series([u'en:OK', u'en:NEW', u'en:תודה!']))
+        self.assertListEqual(backend.batches, [[u'new']])
+
+    def test_cache_by_target_language(self):
+        cache = TranslationCache(':memory:')
+        translate_series(pd.Series([u'ok']), FakeBackend(), cache=cache)
+        backend = FakeBackend()
+
+        actual = translate_series(pd.Series([u'ok']), backend, target_language='fr', cache=cache)
+
+        assert_series_equal(actual, pd.Series([u'fr:OK']))
+        self.assertListEqual(backend.batches, [[u'ok']])
+
+    def test_running_event_loop(self):
+        contents = pd.Series([u'ok', u'hi', u'ok'])
+        cache = TranslationCache(':memory:')
+
+        async def translate():
+            # the sync function works from a coroutine too, e.g. in Jupyter, by running its loop in another thread
+            sync_translations = translate_series(contents, FakeBackend(), target_language='fr', cache=cache)
+            return sync_translations, await translate_series_async(contents, FakeBackend(), cache=cache)
+
+        sync_translations, async_translations = asyncio.run(translate())
+        assert_series_equal(sync_translations, pd.Series([u'fr:OK', u'fr:HI', u'fr:OK']))
+        assert_series_equal(async_translations, pd.Series([u'en:OK', u'en:HI', u'en:OK']))
+        self.assertDictEqual(cache.get([u'ok'], 'fr'), {u'ok': u'fr:OK'})